@@ -0,0 +1,84 @@
+import re
+from datetime import date
+
+# Учебный год начинается в сентябре
+ACADEMIC_YEAR_START_MONTH = 9
+
+ACADEMIC_YEAR_PATTERN = re.compile(r'(20\d{2})\s*[-–/_]\s*(20\d{2}|\d{2})')
+DATE_PATTERN = re.compile(r'^(\d{1,2})\.(\d{1,2})(?:\.(\d{4}))?$')
+# Семестр: "ГГГГ-1" - осенний (сентябрь-январь), "ГГГГ-2" - весенний (февраль-август) учебного года ГГГГ/ГГГГ+1
+TERM_PATTERN = re.compile(r'^(20\d{2})-([12])$')
+
+def current_academic_year(today: date = None) -> int:
+    """Возвращает год начала текущего учебного года"""
+    today = today or date.today()
+    return today.year if today.month >= ACADEMIC_YEAR_START_MONTH else today.year - 1
+
+def academic_year_from_name(name: str):
+    """Извлекает год начала учебного года из имени файла или листа ("2024-2025", "2024/25")"""
+    match = ACADEMIC_YEAR_PATTERN.search(name or '')
+    return int(match.group(1)) if match else None
+
+def year_for_month(month: int, academic_year: int) -> int:
+    """Календарный год месяца внутри учебного года"""
+    return academic_year if month >= ACADEMIC_YEAR_START_MONTH else academic_year + 1
+
+def nearest_year(month: int, day: int, today: date = None) -> int:
+    """Год, при котором дата DD.MM отстоит от today не больше чем на полгода
+    (расписание на осень, загруженное в августе, относится к наступающему учебному году)"""
+    today = today or date.today()
+    # Смещение даты от today в месяцах (с учетом дня) внутри одного календарного года
+    offset = (month - today.month) + (day - today.day) / 31
+    if offset > 6:
+        return today.year - 1
+    if offset <= -6:
+        return today.year + 1
+    return today.year
+
+def resolve_date(date_str: str, academic_year: int = None):
+    """Преобразует строку DD.MM (или DD.MM.YYYY) в дату внутри учебного года academic_year,
+    а если он неизвестен - в ближайшую к сегодняшнему дню"""
+    match = DATE_PATTERN.match(date_str.strip())
+    if not match:
+        return None
+    day, month = int(match.group(1)), int(match.group(2))
+    if match.group(3):
+        year = int(match.group(3))
+    elif academic_year is not None:
+        year = year_for_month(month, academic_year)
+    else:
+        year = nearest_year(month, day)
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+def entry_date(entry):
+    """Дата записи: из поля full_date, а для старых записей - ближайшая к сегодняшнему дню"""
+    full_date = entry.get('full_date')
+    if full_date:
+        return date.fromisoformat(full_date)
+    return resolve_date(entry.get('date', ''))
+
+def term_of(day: date) -> str:
+    """Семестр, к которому относится дата"""
+    academic_year = current_academic_year(day)
+    return f"{academic_year}-{1 if day.month >= ACADEMIC_YEAR_START_MONTH or day.month == 1 else 2}"
+
+def term_bounds(term: str) -> tuple:
+    """Первый и последний дни семестра"""
+    academic_year, half = int(term[:4]), term[5:]
+    if half == '1':
+        return date(academic_year, ACADEMIC_YEAR_START_MONTH, 1), date(academic_year + 1, 1, 31)
+    return date(academic_year + 1, 2, 1), date(academic_year + 1, ACADEMIC_YEAR_START_MONTH - 1, 31)
+
+def parse_term(text: str):
+    """Семестр из строки "ГГГГ-1" / "ГГГГ-2" или None"""
+    match = TERM_PATTERN.match(text.strip())
+    return match.group(0) if match else None
+
+def term_label(term: str) -> str:
+    """Название семестра для сообщений (например, 2024/25, весенний семестр)"""
+    academic_year = int(term[:4])
+    half = 'осенний' if term.endswith('-1') else 'весенний'
+    return f"{academic_year}/{(academic_year + 1) % 100:02d}, {half} семестр"
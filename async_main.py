@@ -0,0 +1,63 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from telebot.async_telebot import AsyncTeleBot
+from handlers import initialize_schedule_index
+from main import register_handlers
+from metrics import instrument_handler, start_metrics_server
+from digest import start_scheduler
+from ingest import start_compaction
+
+# Загрузка переменных окружения
+load_dotenv()
+TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+
+# Число потоков, в которых выполняются синхронные обработчики
+HANDLER_THREADS = int(os.getenv("HANDLER_THREADS", "16"))
+
+# Создание асинхронного экземпляра бота (получение обновлений)
+async_bot = AsyncTeleBot(TOKEN)
+handler_executor = ThreadPoolExecutor(max_workers=HANDLER_THREADS, thread_name_prefix='handler')
+
+# Блокировки чатов: chat_id -> [блокировка, число ожидающих обработчиков]
+chat_locks = {}
+
+def as_coroutine(handler):
+    """Оборачивает обработчик в корутину: чаты обрабатываются параллельно, сообщения одного чата - по порядку"""
+    @functools.wraps(handler)
+    async def wrapper(message):
+        # Нажатия кнопок относятся к чату своего сообщения, у inline-запросов чата нет -
+        # их упорядочиваем по пользователю
+        if getattr(message, 'chat', None):
+            chat_id = message.chat.id
+        elif getattr(message, 'message', None):
+            chat_id = message.message.chat.id
+        else:
+            chat_id = message.from_user.id
+        entry = chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(handler_executor, handler, message)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del chat_locks[chat_id]
+    return wrapper
+
+# Регистрация тех же обработчиков в виде корутин со сбором метрик
+register_handlers(async_bot, wrap=lambda handler: as_coroutine(instrument_handler(handler)))
+
+# Запуск бота в режиме asyncio
+if __name__ == '__main__':
+    # Построение индекса преподавателей при запуске
+    initialize_schedule_index()
+    start_metrics_server()
+    # Ежедневная рассылка подписчикам
+    start_scheduler()
+    # Перенос устаревших записей в архив
+    start_compaction()
+    asyncio.run(async_bot.polling(non_stop=True))
@@ -0,0 +1,145 @@
+"""Локальная замена Telegram Bot API для сквозных замеров обработчиков"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+class FakeTelegramAPI:
+    """HTTP-сервер, отвечающий на методы Bot API, которые использует бот"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.files = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.message_id = 0
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """Адрес сервера для TELEGRAM_API_URL"""
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_file(self, file_id: str, content: bytes):
+        """Регистрирует файл, который бот сможет скачать через getFile"""
+        self.files[file_id] = content
+
+    def count(self, method: str, chat_id=None) -> int:
+        """Число вызовов метода (для чата chat_id, если он указан)"""
+        with self.lock:
+            return sum(1 for request in self.requests
+                       if request['method'] == method and (chat_id is None or request['chat_id'] == chat_id))
+
+    def wait_until(self, predicate, timeout: float = 120.0):
+        """Ждет запрос, удовлетворяющий predicate(request), и возвращает его (или None по таймауту)"""
+        deadline = time.monotonic() + timeout
+        checked = 0
+        with self.condition:
+            while True:
+                for request in self.requests[checked:]:
+                    if predicate(request):
+                        return request
+                checked = len(self.requests)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def reset(self):
+        """Очищает журнал запросов"""
+        with self.lock:
+            self.requests.clear()
+
+    def record(self, method: str, params: dict) -> int:
+        """Записывает запрос в журнал и возвращает номер сообщения для ответа"""
+        with self.condition:
+            self.requests.append({
+                'method': method,
+                'chat_id': params.get('chat_id'),
+                'text': params.get('text'),
+                'time': time.monotonic()
+            })
+            self.message_id += 1
+            self.condition.notify_all()
+            return self.message_id
+
+    def make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                self.handle_request()
+
+            def do_POST(self):
+                self.handle_request()
+
+            def handle_request(self):
+                parsed = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length).decode('utf-8', errors='replace')
+                    params.update({key: values[0] for key, values in parse_qs(body).items()})
+
+                parts = parsed.path.strip('/').split('/')
+                if parts[0] == 'file':
+                    file_id = parts[-1]
+                    if file_id not in api.files:
+                        self.send_response(404)
+                        self.end_headers()
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(api.files[file_id])))
+                    self.end_headers()
+                    self.wfile.write(api.files[file_id])
+                    return
+
+                method = parts[-1]
+                message_id = api.record(method, params)
+                self.reply(api.result_for(method, params, message_id))
+
+            def reply(self, result):
+                body = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def result_for(self, method: str, params: dict, message_id: int):
+        """Ответ Bot API на вызов метода"""
+        if method == 'getFile':
+            file_id = params.get('file_id')
+            return {
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'file_size': len(self.files.get(file_id, b'')),
+                'file_path': f"documents/{file_id}"
+            }
+        if method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params.get('chat_id', 0))
+            return {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', '')
+            }
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        return True
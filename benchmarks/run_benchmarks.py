@@ -0,0 +1,232 @@
+"""Замеры производительности загрузки, хранения и поиска расписания.
+
+Запуск из корня репозитория:
+    python benchmarks/run_benchmarks.py [--sizes 1000 10000 100000] [--repeat 5] [--skip-e2e]
+
+Все данные создаются во временном каталоге; сквозные замеры используют локальную
+замену Telegram Bot API (fake_telegram_api.py), поэтому токен и сеть не нужны.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+from fake_telegram_api import FakeTelegramAPI
+from workbook_generator import generate_workbook
+
+def setup_environment(workdir: str, api_url: str, rate_limit: bool):
+    """Настраивает окружение до импорта модулей бота"""
+    os.chdir(workdir)
+    os.environ["TELEGRAM_BOT_TOKEN"] = "123456:BENCHMARK"
+    os.environ["TELEGRAM_API_URL"] = api_url
+    if not rate_limit:
+        os.environ["SENDER_GLOBAL_RATE"] = "100000"
+
+def measure(func, repeat: int) -> float:
+    """Медиана времени выполнения func в секундах"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def report(name: str, size: int, seconds: float, extra: str = ''):
+    print(f"{name:<32} {size:>8} {seconds * 1000:>12.3f} ms  {extra}")
+
+def reset_storage(size: int):
+    """Переключает хранилище и индексы на пустую базу для замера"""
+    import file_processing
+    import ingest
+    import schedule_index
+    import schedule_render
+    import sender
+    import storage
+    data_dir = f"data_{size}"
+    # Рабочие процессы разбора получают путь к базе через окружение при запуске
+    os.environ["SCHEDULE_DB_PATH"] = os.path.join(data_dir, "schedule.db")
+    storage.DB_PATH = os.environ["SCHEDULE_DB_PATH"]
+    storage.ARCHIVE_DIR = os.path.join(data_dir, "archive")
+    schedule_index.SNAPSHOT_PATH = os.path.join(data_dir, "index.snapshot")
+    # Пул, запущенный для предыдущего размера, пересоздаем с новым окружением
+    if ingest.process_pool is not None:
+        ingest.process_pool.shutdown()
+        ingest.process_pool = None
+    # Чаты замеров используют одни и те же номера: лимиты прошлого замера не должны их тормозить
+    with sender.condition:
+        sender.chat_buckets.clear()
+        sender.paused_until.clear()
+    file_processing.entry_keys = None
+    schedule_index.clear_index()
+    schedule_render.invalidate_cache()
+
+def bench_ingest(size: int, workbook: bytes, repeat: int):
+    """Разбор файла и фиксация записей тем же путем, что и при загрузке в боте"""
+    import ingest
+    from file_processing import parse_excel_file, prepare_revision
+
+    file_name = f"bench_{size}.xlsx"
+    seconds = measure(lambda: parse_excel_file(workbook, file_name), repeat)
+    report("ingest: parse_excel_file", size, seconds, f"{size / seconds:,.0f} записей/с")
+
+    start = time.perf_counter()
+    revision = ingest.commit_revisions([prepare_revision(workbook, file_name)])[0]
+    seconds = time.perf_counter() - start
+    report("ingest: prepare + commit", size, seconds, f"{revision.get('new_entries_count', 0)} новых записей")
+    return parse_excel_file(workbook, file_name)
+
+def bench_storage(size: int, workbook: bytes, repeat: int):
+    """Загрузка всех данных и повторная загрузка файла с небольшой правкой"""
+    import ingest
+    from file_processing import load_existing_data, prepare_revision
+    from workbook_generator import generate_workbook
+
+    seconds = measure(load_existing_data, repeat)
+    report("storage: load_existing_data", size, seconds)
+
+    # Версии файла чередуются: каждая фиксация заменяет 1% записей
+    delta_size = max(1, size // 100)
+    versions = [generate_workbook(size, changed_count=delta_size), workbook]
+    revisions = []
+    def commit_delta():
+        versions.reverse()
+        revisions[:] = ingest.commit_revisions([prepare_revision(versions[-1], f"bench_{size}.xlsx")])
+    seconds = measure(commit_delta, repeat)
+    report("storage: re-upload (1% changed)", size, seconds,
+           f"добавлено {revisions[0].get('new_entries_count', 0)}, удалено {revisions[0].get('removed_entries_count', 0)}")
+
+def bench_lookup(size: int, entries: list, repeat: int):
+    """Построение индекса, поиск фамилии и формирование сообщений"""
+    import name_search
+    import schedule_index
+    import schedule_render
+
+    seconds = measure(lambda: schedule_index.build_index(entries), 1)
+    report("lookup: build_index", size, seconds)
+
+    teachers = list(schedule_index.teacher_index)
+    random.seed(size)
+    queries = [random.choice(teachers) for _ in range(200)]
+    today = datetime.now().date()
+    start_date, end_date = today - timedelta(days=14), today + timedelta(days=28)
+
+    seconds = measure(lambda: [schedule_index.find_entries(q, start_date, end_date) for q in queries], repeat)
+    report("lookup: find_entries", size, seconds / len(queries), "на запрос")
+
+    # Опечатка в фамилии: пропущена предпоследняя буква
+    typos = [q.split()[0][:-2] + q.split()[0][-1:] for q in queries]
+    seconds = measure(lambda: [name_search.search(q) for q in queries + typos], repeat)
+    report("lookup: name_search.search", size, seconds / (2 * len(queries)), "на запрос (с опечатками)")
+
+    week = schedule_render.week_start(today)
+    def render_week_uncached():
+        for q in queries:
+            schedule_render.invalidate_cache()
+            schedule_render.get_week_page(q, week)
+    seconds = measure(render_week_uncached, repeat)
+    report("lookup: week page (miss)", size, seconds / len(queries), "на запрос")
+
+    seconds = measure(lambda: [schedule_render.get_week_page(q, week) for q in queries], repeat)
+    report("lookup: week page (hit)", size, seconds / len(queries), f"{schedule_render.get_cache_stats()}")
+
+def make_message(chat_id: int, text: str = None, document: dict = None):
+    """Создает объект сообщения Telegram"""
+    from telebot import types
+    data = {
+        'message_id': random.randint(1, 10 ** 9),
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'}
+    }
+    if text is not None:
+        data['text'] = text
+    if document is not None:
+        data['document'] = document
+    return types.Message.de_json(data)
+
+def wait_for_outbox(timeout: float = 300.0):
+    """Ждет, пока все исходящие сообщения будут отправлены"""
+    import sender
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with sender.condition:
+            if not sender.chat_queues and not sender.busy_chats:
+                return
+        time.sleep(0.005)
+
+def bench_end_to_end(size: int, workbook: bytes, api: FakeTelegramAPI, chats: int):
+    """Сквозной замер: загрузка файла администратором и запросы преподавателей"""
+    import handlers
+    import schedule_index
+    import sessions
+
+    reset_storage(f"e2e_{size}")
+    admin_chat = 1
+    sessions.set_role(admin_chat, "Admin")
+    file_id = f"bench-{size}"
+    api.add_file(file_id, workbook)
+    api.reset()
+
+    start = time.perf_counter()
+    handlers.handle_document(make_message(admin_chat, document={
+        'file_id': file_id,
+        'file_unique_id': file_id,
+        'file_name': f"bench_{size}.xlsx"
+    }))
+    done = api.wait_until(lambda request: request['chat_id'] == str(admin_chat) and
+                          (request['text'] or '').startswith(('✅', '❌')))
+    seconds = time.perf_counter() - start
+    report("e2e: upload", size, seconds, (done or {}).get('text') or 'таймаут')
+
+    surnames = list(schedule_index.teacher_index)
+    api.reset()
+    start = time.perf_counter()
+    for i in range(chats):
+        chat_id = 1000 + i
+        handlers.handle_show_schedule(make_message(chat_id, 'Показать расписание'))
+        handlers.handle_text(make_message(chat_id, surnames[i % len(surnames)]))
+    handlers_seconds = time.perf_counter() - start
+    wait_for_outbox()
+    seconds = time.perf_counter() - start
+    messages = api.count('sendMessage')
+    report("e2e: lookups (handlers)", size, handlers_seconds / chats, "на запрос до возврата из обработчика")
+    report("e2e: lookups (delivered)", size, seconds,
+           f"{chats} запросов, {messages} сообщений, {messages / seconds:,.0f} сообщений/с")
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности бота расписания")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--chats', type=int, default=200, help="число чатов в сквозном замере")
+    parser.add_argument('--skip-e2e', action='store_true')
+    parser.add_argument('--rate-limit', action='store_true', help="не отключать общий лимит отправки")
+    args = parser.parse_args()
+
+    api = FakeTelegramAPI().start()
+    workdir = tempfile.mkdtemp(prefix='schedule_bench_')
+    setup_environment(workdir, api.url, args.rate_limit)
+    print(f"Каталог данных: {workdir}")
+    print(f"{'замер':<32} {'записей':>8} {'время':>15}")
+
+    try:
+        for size in args.sizes:
+            workbook = generate_workbook(size)
+            reset_storage(size)
+            entries = bench_ingest(size, workbook, args.repeat)
+            bench_storage(size, workbook, args.repeat)
+            bench_lookup(size, entries, args.repeat)
+            if not args.skip_e2e:
+                bench_end_to_end(size, workbook, api, args.chats)
+    finally:
+        api.stop()
+
+if __name__ == '__main__':
+    main()
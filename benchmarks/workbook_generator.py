@@ -0,0 +1,63 @@
+"""Генератор синтетических Excel-файлов расписания в формате, который ожидает parse_excel_file"""
+import math
+from datetime import datetime, timedelta
+from io import BytesIO
+from openpyxl import Workbook
+
+PREAMBLE_ROWS = 14
+HEADER = ['Дата', 'Название предмета', None, 'Преподаватель', 'Часы', 'Ауд.']
+
+SURNAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов',
+            'Михайлов', 'Новиков', 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семенов']
+TITLES = ['доц.', 'ст.преп.', 'проф.', '']
+SUBJECTS = ['Математический анализ', 'Линейная алгебра', 'Физика', 'Программирование', 'Базы данных',
+            'Иностранный язык', 'История', 'Философия', 'Экономика', 'Теория вероятностей']
+LESSON_TYPES = ['лек', 'пр', 'лаб', None]
+TIME_SLOTS = ['08.30-10.00', '10.10-11.40', '12.20-13.50', '14.00-15.30', '15.40-17.10', '17.20-18.50']
+
+# Число дней, на которые распределяются занятия
+SCHEDULE_DAYS = 120
+
+def teacher_name(index: int) -> str:
+    """Уникальное имя преподавателя с званием и инициалами"""
+    surname = SURNAMES[index % len(SURNAMES)]
+    if index >= len(SURNAMES):
+        surname += str(index // len(SURNAMES))
+    title = TITLES[index % len(TITLES)]
+    return f"{title} {surname} А.Б.".strip()
+
+def generate_entries(entries_count: int, start_date: datetime = None, changed_count: int = 0):
+    """Генерирует строки расписания с уникальным ключом (дата, предмет, преподаватель).
+    У первых changed_count строк предмет изменен (повторная загрузка с правками)"""
+    start_date = start_date or datetime.now() - timedelta(days=SCHEDULE_DAYS // 2)
+    teachers_count = max(10, math.ceil(entries_count / SCHEDULE_DAYS))
+    for i in range(entries_count):
+        teacher = i % teachers_count
+        day = (i // teachers_count) % SCHEDULE_DAYS
+        yield [
+            start_date + timedelta(days=day),
+            SUBJECTS[(teacher + day) % len(SUBJECTS)] + (' (изм.)' if i < changed_count else ''),
+            LESSON_TYPES[i % len(LESSON_TYPES)],
+            teacher_name(teacher),
+            TIME_SLOTS[(teacher + day) % len(TIME_SLOTS)],
+            str(100 + (teacher * 7 + day) % 300)
+        ]
+
+def generate_workbook(entries_count: int, sheets_count: int = None, changed_count: int = 0) -> bytes:
+    """Создает .xlsx с entries_count записями, распределенными по листам-группам"""
+    sheets_count = sheets_count or max(1, entries_count // 500)
+    workbook = Workbook(write_only=True)
+    sheets = []
+    for i in range(sheets_count):
+        sheet = workbook.create_sheet(f"Группа {i + 1}")
+        for row in range(PREAMBLE_ROWS):
+            sheet.append([f"Строка шапки {row + 1}"])
+        sheet.append(HEADER)
+        sheets.append(sheet)
+
+    for i, row in enumerate(generate_entries(entries_count, changed_count=changed_count)):
+        sheets[i % sheets_count].append(row)
+
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
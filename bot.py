@@ -1,10 +1,16 @@
 import os
 from dotenv import load_dotenv
-from telebot import TeleBot
+from telebot import TeleBot, apihelper
 
 # Загрузка переменных окружения
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+# Адрес Bot API (например, локальный сервер); по умолчанию api.telegram.org
+API_URL = os.getenv("TELEGRAM_API_URL")
+if API_URL:
+    apihelper.API_URL = API_URL.rstrip('/') + "/bot{0}/{1}"
+    apihelper.FILE_URL = API_URL.rstrip('/') + "/file/bot{0}/{1}"
+
 # Создание экземпляра бота
-bot = TeleBot(TOKEN)
\ No newline at end of file
+bot = TeleBot(TOKEN)
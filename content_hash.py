@@ -0,0 +1,115 @@
+import hashlib
+import posixpath
+import zipfile
+from io import BytesIO
+from xml.etree.ElementTree import iterparse
+
+# Пространства имен SpreadsheetML (.xlsx)
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# Размер блока при чтении файла для хэширования
+READ_CHUNK_BYTES = 1024 * 1024
+
+def as_file(source):
+    """Путь к файлу или содержимое в памяти -> объект, который принимают zipfile и openpyxl"""
+    return BytesIO(source) if isinstance(source, bytes) else source
+
+def is_xlsx(source) -> bool:
+    """Файл .xlsx (zip-пакет), иначе считаем его .xls"""
+    return zipfile.is_zipfile(as_file(source))
+
+def open_xls(source):
+    """Открывает .xls с загрузкой листов по требованию (файл на диске отображается в память)"""
+    import xlrd
+    if isinstance(source, bytes):
+        return xlrd.open_workbook(file_contents=source, on_demand=True)
+    return xlrd.open_workbook(source, on_demand=True, use_mmap=True)
+
+def file_hash(source) -> str:
+    """Хэш содержимого файла (путь или содержимое в памяти)"""
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+    hasher = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_BYTES), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def sheet_hashes(source) -> dict:
+    """Хэши значений ячеек каждого листа: {лист: хэш}. Файл не разбирается через pandas,
+    оформление на хэш не влияет"""
+    if is_xlsx(source):
+        return xlsx_sheet_hashes(source)
+    return xls_sheet_hashes(source)
+
+def xlsx_sheet_paths(archive: zipfile.ZipFile) -> dict:
+    """Пути частей листов внутри .xlsx: {лист: путь}"""
+    targets = {}
+    with archive.open('xl/_rels/workbook.xml.rels') as f:
+        for _, elem in iterparse(f):
+            if elem.tag == PACKAGE_REL_NS + 'Relationship':
+                target = elem.get('Target')
+                # Путь задается относительно каталога xl/ или от корня пакета
+                targets[elem.get('Id')] = target.lstrip('/') if target.startswith('/') else posixpath.normpath('xl/' + target)
+    paths = {}
+    with archive.open('xl/workbook.xml') as f:
+        for _, elem in iterparse(f):
+            if elem.tag == MAIN_NS + 'sheet':
+                paths[elem.get('name')] = targets[elem.get(REL_NS + 'id')]
+    return paths
+
+def xlsx_shared_strings(archive: zipfile.ZipFile) -> list:
+    """Таблица общих строк .xlsx"""
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as f:
+        for _, elem in iterparse(f):
+            if elem.tag == MAIN_NS + 'si':
+                strings.append(''.join(t.text or '' for t in elem.iter(MAIN_NS + 't')))
+                elem.clear()
+    return strings
+
+def xlsx_sheet_hashes(source) -> dict:
+    """Хэши листов .xlsx по значениям ячеек (ссылки на общие строки заменяются текстом)"""
+    hashes = {}
+    with zipfile.ZipFile(as_file(source)) as archive:
+        shared_strings = xlsx_shared_strings(archive)
+        for sheet_name, path in xlsx_sheet_paths(archive).items():
+            hasher = hashlib.sha256()
+            with archive.open(path) as f:
+                for _, elem in iterparse(f):
+                    if elem.tag == MAIN_NS + 'c':
+                        cell_type = elem.get('t')
+                        if cell_type == 'inlineStr':
+                            value = ''.join(t.text or '' for t in elem.iter(MAIN_NS + 't'))
+                        else:
+                            value_elem = elem.find(MAIN_NS + 'v')
+                            value = value_elem.text if value_elem is not None else None
+                            if cell_type == 's' and value is not None:
+                                value = shared_strings[int(value)]
+                        if value is not None:
+                            hasher.update(f"{elem.get('r', '')}\t{value}\n".encode('utf-8'))
+                    elif elem.tag == MAIN_NS + 'row':
+                        hasher.update(f"#{elem.get('r', '')}\n".encode('utf-8'))
+                        elem.clear()
+            hashes[sheet_name] = hasher.hexdigest()
+    return hashes
+
+def xls_sheet_hashes(source) -> dict:
+    """Хэши листов .xls по значениям ячеек (листы загружаются по одному)"""
+    book = open_xls(source)
+    try:
+        hashes = {}
+        for sheet_name in book.sheet_names():
+            sheet = book.sheet_by_name(sheet_name)
+            hasher = hashlib.sha256()
+            for row in range(sheet.nrows):
+                hasher.update(f"{row}\t{sheet.row_values(row)!r}\n".encode('utf-8'))
+            hashes[sheet_name] = hasher.hexdigest()
+            book.unload_sheet(sheet_name)
+        return hashes
+    finally:
+        book.release_resources()
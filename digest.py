@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import name_search
+import schedule_index
+import schedule_render
+import sender
+import storage
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Время ежедневной рассылки расписания на следующий день (ЧЧ:ММ, местное время);
+# пустое значение отключает рассылку
+DIGEST_TIME = os.getenv("DIGEST_TIME", "19:00")
+
+scheduler_thread = None
+
+def seconds_until_next_run(now: datetime = None) -> float:
+    """Время до ближайшего запуска рассылки"""
+    now = now or datetime.now()
+    hour, minute = map(int, DIGEST_TIME.split(':'))
+    run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run_at <= now:
+        run_at += timedelta(days=1)
+    return (run_at - now).total_seconds()
+
+def build_digests(day) -> list:
+    """Формирует рассылку на день одним проходом: подписчики группируются по преподавателю,
+    расписание каждого преподавателя формируется один раз. Возвращает [(chat_ids, сообщения)]"""
+    subscribers = {}
+    for chat_id, teacher in storage.load_subscriptions():
+        # Старые подписки хранят только фамилию: она сопоставляется, если преподаватель однозначен
+        key = schedule_index.known_teacher(teacher)
+        if key is None:
+            continue
+        subscribers.setdefault(key, []).append(chat_id)
+
+    digests = []
+    for key, chat_ids in subscribers.items():
+        entries = schedule_index.find_entries(key, day, day)
+        # Без занятий на этот день ничего не отправляем
+        if not entries:
+            continue
+        header = f"Расписание на {day:%d.%m.%Y} ({name_search.display_name(key)}):"
+        digests.append((chat_ids, [header] + schedule_render.render_schedule(entries)))
+    return digests
+
+def send_digests(day=None) -> int:
+    """Ставит рассылку на день (по умолчанию - на завтра) в очередь отправки. Возвращает число чатов"""
+    day = day or datetime.now().date() + timedelta(days=1)
+    with metrics.operation('job', 'daily_digest'):
+        with metrics.stage('build_digests'):
+            digests = build_digests(day)
+        chats = 0
+        for chat_ids, messages in digests:
+            for chat_id in chat_ids:
+                sender.send_message(chat_id, messages[0])
+                for message in messages[1:]:
+                    sender.send_message(chat_id, message, parse_mode="Markdown")
+            chats += len(chat_ids)
+    metrics.inc('digests_sent_total', chats)
+    logger.info("Рассылка на %s: преподавателей %s, чатов %s", day, len(digests), chats)
+    return chats
+
+def scheduler_loop():
+    """Ежедневно в DIGEST_TIME отправляет подписчикам расписание на следующий день"""
+    while True:
+        time.sleep(seconds_until_next_run())
+        try:
+            send_digests()
+        except Exception as e:
+            logger.error("Не удалось выполнить рассылку: %s", e)
+
+def start_scheduler():
+    """Запускает поток рассылки, если задано DIGEST_TIME"""
+    global scheduler_thread
+    if not DIGEST_TIME or scheduler_thread is not None:
+        return None
+    scheduler_thread = threading.Thread(target=scheduler_loop, name='digest-scheduler', daemon=True)
+    scheduler_thread.start()
+    return scheduler_thread
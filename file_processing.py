@@ -1,127 +1,302 @@
-import pandas as pd
-import json
-import os
-from datetime import datetime
-from io import BytesIO
+import sys
+from datetime import date, datetime
+from itertools import islice
+import storage
+import content_hash
+import metrics
+from metrics import timed
+from academic_calendar import (
+    ACADEMIC_YEAR_START_MONTH,
+    DATE_PATTERN,
+    academic_year_from_name,
+    nearest_year
+)
 
+# Ключи (полная дата, subject, teacher) уже сохраненных записей для проверки дубликатов.
+# Загружаются из хранилища при первом обращении
+entry_keys = None
+
+def entry_key(entry):
+    """Ключ записи для проверки дубликатов (как idx_entries_key в хранилище): полная дата,
+    а если год неизвестен - DD.MM"""
+    return (entry.get('full_date') or entry['date'], entry['subject'], entry['teacher'])
+
+def get_entry_keys() -> set:
+    """Возвращает множество ключей сохраненных записей"""
+    global entry_keys
+    if entry_keys is None:
+        entry_keys = storage.load_entry_keys()
+    return entry_keys
+
+@timed('load_existing_data')
 def load_existing_data():
-    """Загружает существующие данные из файла"""
-    if os.path.exists('data/schedule.json'):
-        with open('data/schedule.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if isinstance(data, list):
-                return {
-                    "meta": {
-                        "processed_files": [],
-                        "version": 1
-                    },
-                    "schedule_data": data
-                }
-            return data
-    return {
-        "meta": {
-            "processed_files": [],
-            "version": 1
-        },
-        "schedule_data": []
-    }
+    """Загружает существующие данные из хранилища"""
+    global entry_keys
+    data = storage.load_data()
+    entry_keys = {entry_key(entry) for entry in data["schedule_data"]}
+    return data
+
+def remember_entry_keys(entries):
+    """Добавляет ключи сохраненных записей"""
+    get_entry_keys().update(entry_key(entry) for entry in entries)
+
+def forget_entry_keys(entries):
+    """Убирает ключи удаленных записей из множества сохраненных"""
+    keys = get_entry_keys()
+    for entry in entries:
+        keys.discard(entry_key(entry))
+
+def clear_data() -> bool:
+    """Удаляет все данные расписания. Возвращает False, если данных не было"""
+    global entry_keys
+    entry_keys = None
+    return storage.clear_data()
+
+# Соответствие заголовков листа полям записи (пустой заголовок - тип занятия)
+# Строка заголовков таблицы (после шапки листа) и размер порции строк при разборе
+HEADER_ROW = 14
+PARSE_CHUNK_ROWS = 5000
+# Значение пустой ячейки (как у pandas.read_excel)
+EMPTY_CELL = float('nan')
+# Значения ошибок в ячейках (как openpyxl.cell.cell.ERROR_CODES). pandas и openpyxl
+# загружаются только при разборе файла, чтобы не замедлять запуск бота
+ERROR_CODES = frozenset(('#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A'))
+
+HEADER_MAPPING = {
+    'Дата': 'date',
+    'Название предмета': 'subject',
+    'Преподаватель': 'teacher',
+    'Часы': 'time',
+    'Ауд.': 'audience'
+}
+
+def format_dates(dates, academic_year):
+    """Приводит столбец дат к строкам DD.MM и к полным датам YYYY-MM-DD внутри учебного года
+    (если учебный год неизвестен - ближайшим к дню загрузки)"""
+    import pandas as pd
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates.dt.strftime('%d.%m'), dates.dt.strftime('%Y-%m-%d')
+
+    date_strs = dates.astype(str).str.split().str[0]
+    parts = date_strs.str.extract(DATE_PATTERN.pattern).astype(float)
+    days, months, years = parts[0], parts[1], parts[2]
+    if academic_year is not None:
+        years = years.fillna((months < ACADEMIC_YEAR_START_MONTH) + academic_year)
+    else:
+        today = date.today()
+        years = years.fillna(pd.Series([
+            nearest_year(int(month), int(day), today) if month == month and day == day else float('nan')
+            for month, day in zip(months, days)
+        ], index=months.index))
+    full_dates = pd.to_datetime(
+        pd.DataFrame({'year': years, 'month': months, 'day': days}),
+        errors='coerce'
+    ).dt.strftime('%Y-%m-%d')
+
+    is_datetime = dates.map(lambda value: isinstance(value, datetime)).astype(bool)
+    if is_datetime.any():
+        real_dates = pd.to_datetime(dates.where(is_datetime), errors='coerce')
+        date_strs = date_strs.mask(is_datetime, real_dates.dt.strftime('%d.%m'))
+        full_dates = full_dates.mask(is_datetime, real_dates.dt.strftime('%Y-%m-%d'))
+    return date_strs, full_dates
+
+def parse_sheet(df, sheet_name: str, academic_year) -> list:
+    """Разбирает лист расписания (первая строка - заголовки) в список записей"""
+    import pandas as pd
+    if df.empty or len(df.columns) < 6:
+        return []
+
+    column_mapping = {}
+    for i, header in enumerate(df.iloc[0].tolist()):
+        if pd.isna(header) or str(header).strip() == '':
+            column_mapping[i] = 'type'
+        elif str(header).strip() in HEADER_MAPPING:
+            column_mapping[i] = HEADER_MAPPING[str(header).strip()]
+
+    df = df.rename(columns=column_mapping)[1:]
+    # Из нескольких пустых столбцов тип занятия берем из первого
+    df = df.loc[:, ~df.columns.duplicated()]
+
+    required_columns = ['date', 'subject', 'teacher', 'time', 'audience']
+    if any(col not in df.columns for col in required_columns):
+        return []
+
+    df = df.dropna(subset=['date', 'subject', 'teacher'])
+    if df.empty:
+        return []
+
+    dates, full_dates = format_dates(df['date'], academic_year_from_name(sheet_name) or academic_year)
+    valid = dates.notna()
+    df, dates, full_dates = df[valid], dates[valid], full_dates[valid]
 
-def save_data(data):
-    """Сохраняет данные в файл"""
-    os.makedirs('data', exist_ok=True)
-    with open('data/schedule.json', 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    if 'type' in df.columns:
+        types = df['type'].astype(str).where(df['type'].notna(), None).tolist()
+    else:
+        types = [None] * len(df)
 
-def process_excel_file(file_bytes: bytes, file_name: str) -> dict:
+    entries = []
+    for date_str, full_date, subject, teacher, time, audience, entry_type in zip(
+        dates.tolist(),
+        full_dates.where(full_dates.notna(), None).tolist(),
+        df['subject'].astype(str).tolist(),
+        df['teacher'].astype(str).tolist(),
+        df['time'].astype(str).tolist(),
+        df['audience'].astype(str).tolist(),
+        types
+    ):
+        entry = {
+            'sheet': sheet_name,
+            'date': date_str,
+            'subject': subject,
+            'teacher': teacher,
+            'time': time,
+            'audience': audience
+        }
+        if entry_type is not None:
+            entry['type'] = entry_type
+        if full_date is not None:
+            entry['full_date'] = full_date
+        entries.append(entry)
+    return entries
+
+def normalize_cell(value):
+    """Приводит значение ячейки к виду, который дает pandas.read_excel: пустые значения и ошибки - NaN,
+    целые числа с плавающей точкой - int, одинаковые строки - один объект"""
+    if value is None or value == '' or (isinstance(value, str) and value in ERROR_CODES):
+        return EMPTY_CELL
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        # Повторяющиеся строки (преподаватели, предметы, аудитории) храним в одном экземпляре
+        return sys.intern(value)
+    return value
+
+def iter_xlsx_sheets(source, sheet_names=None):
+    """Листы .xlsx в режиме потокового чтения: (лист, итератор строк)"""
+    import openpyxl
+    workbook = openpyxl.load_workbook(content_hash.as_file(source), read_only=True, data_only=True, keep_links=False)
     try:
-        existing_data = load_existing_data()
-        
-        if file_name in existing_data["meta"]["processed_files"]:
-            return {
-                "status": "error",
-                "message": f"Файл {file_name} уже был обработан ранее"
-            }
-            
-        xls = pd.ExcelFile(BytesIO(file_bytes))
-        new_entries = []
-        
-        for sheet_name in xls.sheet_names:
-            try:
-                df = pd.read_excel(xls, sheet_name=sheet_name, header=None, skiprows=14)
-                if df.empty or len(df.columns) < 6:
-                    continue
-                    
-                headers = df.iloc[0].tolist()
-                column_mapping = {}
-                for i, header in enumerate(headers):
-                    if pd.isna(header) or str(header).strip() == '':
-                        column_mapping[i] = 'type'
-                    elif str(header).strip() == 'Дата':
-                        column_mapping[i] = 'date'
-                    elif str(header).strip() == 'Название предмета':
-                        column_mapping[i] = 'subject'
-                    elif str(header).strip() == 'Преподаватель':
-                        column_mapping[i] = 'teacher'
-                    elif str(header).strip() == 'Часы':
-                        column_mapping[i] = 'time'
-                    elif str(header).strip() == 'Ауд.':
-                        column_mapping[i] = 'audience'
-                
-                df = df.rename(columns=column_mapping)
-                df = df[1:]
-                
-                required_columns = ['date', 'subject', 'teacher', 'time', 'audience']
-                missing_columns = [col for col in required_columns if col not in df.columns]
-                if missing_columns:
-                    continue
-                
-                has_type = 'type' in df.columns
-                
-                for _, row in df.iterrows():
-                    try:
-                        if pd.isna(row['date']) or pd.isna(row['subject']) or pd.isna(row['teacher']):
-                            continue
-                            
-                        date_value = row['date']
-                        date_str = date_value.strftime('%d.%m') if isinstance(date_value, datetime) else str(date_value).split()[0]
-                        
-                        new_entry = {
-                            'sheet': sheet_name,
-                            'date': date_str,
-                            'subject': str(row['subject']),
-                            'teacher': str(row['teacher']),
-                            'time': str(row['time']),
-                            'audience': str(row['audience'])
-                        }
-                        
-                        if has_type and not pd.isna(row.get('type')):
-                            new_entry['type'] = str(row['type'])
-                        
-                        is_duplicate = any(
-                            entry['date'] == new_entry['date'] and 
-                            entry['subject'] == new_entry['subject'] and
-                            entry['teacher'] == new_entry['teacher']
-                            for entry in existing_data["schedule_data"]
-                        )
-                        
-                        if not is_duplicate:
-                            new_entries.append(new_entry)
-                    except Exception as e:
-                        continue
-            except Exception as e:
+        for sheet_name in workbook.sheetnames if sheet_names is None else sheet_names:
+            if sheet_name not in workbook.sheetnames:
                 continue
-        
-        existing_data["meta"]["processed_files"].append(file_name)
-        existing_data["schedule_data"].extend(new_entries)
-        
-        return {
-            "status": "success",
-            "data": existing_data,
-            "new_entries_count": len(new_entries)
-        }
-            
-    except Exception as e:
-        return {
-            "status": "error",
-            "message": str(e)
-        }
\ No newline at end of file
+            worksheet = workbook[sheet_name]
+            # Размеры листа в файле бывают неверными, читаем все строки
+            worksheet.reset_dimensions()
+            yield sheet_name, worksheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def xls_cell_value(cell, datemode):
+    """Значение ячейки .xls: даты преобразуются в datetime (или time для значений без даты)"""
+    import xlrd
+    if cell.ctype == xlrd.XL_CELL_DATE:
+        value = xlrd.xldate.xldate_as_datetime(cell.value, datemode)
+        return value.time() if cell.value < 1 else value
+    if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+        return None
+    if cell.ctype == xlrd.XL_CELL_BOOLEAN:
+        return bool(cell.value)
+    return cell.value
+
+def iter_xls_sheets(source, sheet_names=None):
+    """Листы .xls, загружаемые по одному: (лист, итератор строк)"""
+    book = content_hash.open_xls(source)
+    try:
+        for sheet_name in book.sheet_names() if sheet_names is None else sheet_names:
+            if sheet_name not in book.sheet_names():
+                continue
+            sheet = book.sheet_by_name(sheet_name)
+            yield sheet_name, ([xls_cell_value(cell, book.datemode) for cell in sheet.row(i)] for i in range(sheet.nrows))
+            book.unload_sheet(sheet_name)
+    finally:
+        book.release_resources()
+
+def iter_sheets(source, sheet_names=None):
+    """Листы Excel-файла (путь или содержимое) с построчным чтением"""
+    if content_hash.is_xlsx(source):
+        return iter_xlsx_sheets(source, sheet_names)
+    return iter_xls_sheets(source, sheet_names)
+
+def normalize_row(row) -> list:
+    """Значения строки без пустых ячеек в конце (как у pandas.read_excel)"""
+    row = list(row)
+    while row and (row[-1] is None or row[-1] == ''):
+        row.pop()
+    return [normalize_cell(value) for value in row]
+
+def parse_sheet_rows(rows, sheet_name: str, academic_year) -> list:
+    """Разбирает строки листа порциями по PARSE_CHUNK_ROWS, не загружая лист целиком"""
+    rows = islice(rows, HEADER_ROW, None)
+    header = next(rows, None)
+    if header is None:
+        return []
+    header = normalize_row(header)
+
+    import pandas as pd
+    entries = []
+    while True:
+        chunk = [normalize_row(row) for row in islice(rows, PARSE_CHUNK_ROWS)]
+        if not chunk:
+            return entries
+        table = [header] + chunk
+        width = max(len(row) for row in table)
+        table = [row + [EMPTY_CELL] * (width - len(row)) for row in table]
+        entries.extend(parse_sheet(pd.DataFrame(table), sheet_name, academic_year))
+
+@timed('parse_excel_file')
+def parse_excel_sheets(source, file_name: str, sheet_names=None) -> dict:
+    """Разбирает листы Excel-файла (путь или содержимое, по умолчанию все листы): {лист: записи}.
+    Листы читаются по одному в потоковом режиме; листы, которые не удалось прочитать, в результат не попадают"""
+    # Учебный год берем из имени файла (или листа); без него дата без года относится к году,
+    # ближайшему ко дню загрузки
+    academic_year = academic_year_from_name(file_name)
+    sheets = {}
+    for sheet_name, rows in iter_sheets(source, sheet_names):
+        try:
+            sheets[sheet_name] = parse_sheet_rows(rows, sheet_name, academic_year)
+        except Exception as e:
+            continue
+    return sheets
+
+def parse_excel_file(source, file_name: str, sheet_names=None) -> list:
+    """Разбирает листы Excel-файла (по умолчанию все) в список записей (без обращения к хранилищу)"""
+    return [entry for entries in parse_excel_sheets(source, file_name, sheet_names).values() for entry in entries]
+
+def prepare_revision(source, file_name: str, parse: bool = True) -> dict:
+    """Сравнивает хэши файла и его листов с сохраненной версией. Измененные листы разбираются
+    (если parse), неизмененные не читаются вовсе"""
+    base_hash, stored_sheets = storage.load_file_state(file_name)
+    revision = {
+        "file_name": file_name,
+        "base_hash": base_hash,
+        "file_hash": content_hash.file_hash(source),
+        "sheet_hashes": stored_sheets,
+        "changed_sheets": [],
+        "removed_sheets": [],
+        "sheets": {}
+    }
+    if revision["file_hash"] == base_hash:
+        return revision
+
+    with metrics.stage('sheet_hashes'):
+        hashes = content_hash.sheet_hashes(source)
+    revision["sheet_hashes"] = hashes
+    revision["changed_sheets"] = [sheet for sheet, sheet_hash in hashes.items() if stored_sheets.get(sheet) != sheet_hash]
+    revision["removed_sheets"] = [sheet for sheet in stored_sheets if sheet not in hashes]
+    if parse:
+        revision["sheets"] = parse_excel_sheets(source, file_name, revision["changed_sheets"]) if revision["changed_sheets"] else {}
+    return revision
+
+@timed('select_new_entries')
+def select_new_entries(entries, upload_keys=None) -> list:
+    """Отбирает записи, которых нет среди сохраненных и которые не повторяются внутри загрузки.
+    upload_keys - общий набор ключей, если загрузка состоит из нескольких файлов"""
+    existing_keys = get_entry_keys()
+    new_entries = []
+    upload_keys = set() if upload_keys is None else upload_keys
+    for entry in entries:
+        key = entry_key(entry)
+        if key not in existing_keys and key not in upload_keys:
+            upload_keys.add(key)
+            new_entries.append(entry)
+    return new_entries
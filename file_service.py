@@ -1,4 +1,8 @@
-from file_processing import process_excel_file
+import os
+import ingest
+from file_processing import prepare_revision
 
-def process_file(file_path: str):
-    process_excel_file(file_path)
\ No newline at end of file
+def process_file(file_path: str) -> dict:
+    """Загружает файл расписания с диска тем же путем, что и загрузка через бота"""
+    revision = ingest.commit_revisions([prepare_revision(file_path, os.path.basename(file_path))])[0]
+    return ingest.revision_report(revision)
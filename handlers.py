@@ -1,8 +1,20 @@
 import os
 import json
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from telebot import types
-from file_processing import process_excel_file, load_existing_data, save_data
+from file_processing import load_existing_data
+import ingest
+import storage
+import digest
+import occupancy
+from academic_calendar import parse_term, resolve_date, term_label
+import schedule_index
+import name_search
+import schedule_render
+import sender
+import metrics
+import sessions
+from sessions import PendingState
 from bot import bot
 from cryptography.fernet import Fernet
 import base64
@@ -11,13 +23,6 @@ from dotenv import load_dotenv
 # Загрузка переменных окружения
 load_dotenv()
 
-# Словарь для отслеживания состояния
-pending_users = {}
-# Словарь для хранения ролей пользователей
-user_roles = {}
-# Словарь для отслеживания состояния ввода пароля
-pending_password = {}
-
 # Пароль по умолчанию для Admin (используется только если переменная не задана)
 DEFAULT_ADMIN_PASSWORD = "admin123"
 
@@ -103,97 +108,90 @@ def create_keyboard_for_role(role):
 
 def handle_start(message: types.Message):
     """Обработчик команды /start"""
-    global pending_users, pending_password, user_roles
-
     chat_id = message.chat.id
-    
-    # Сбрасываем все состояния (перезагрузка бота)
-    pending_users.clear()
-    pending_password.clear()
-    user_roles.clear()
 
     # Повторно инициализируем шифрование
     initialize_encryption()
 
-    # Устанавливаем роль Teacher по умолчанию для текущего пользователя
-    user_roles[chat_id] = "Teacher"
-    role = user_roles[chat_id]
+    # Сбрасываем состояние только текущего чата: роль Teacher по умолчанию
+    sessions.reset(chat_id)
+    role = sessions.get_role(chat_id)
 
     # Отправляем сообщение о перезагрузке и начальном состоянии
-    bot.reply_to(message, 'Бот перезапущен. Все состояния сброшены.', reply_markup=create_keyboard_for_role(role))
-    bot.send_message(chat_id, f'Выберите действие (роль: {role}):', reply_markup=create_keyboard_for_role(role))
+    sender.reply_to(message, 'Бот перезапущен. Состояние сброшено.', reply_markup=create_keyboard_for_role(role))
+    sender.send_message(chat_id, f'Выберите действие (роль: {role}):', reply_markup=create_keyboard_for_role(role))
 
 def handle_change_role(message: types.Message):
     """Обработчик смены роли"""
     chat_id = message.chat.id
-    role = user_roles.get(chat_id, "Teacher")
-    # Очищаем состояние пароля при смене роли
-    if chat_id in pending_password:
-        del pending_password[chat_id]
-    
+    role = sessions.get_role(chat_id)
+    # Очищаем ожидаемый ввод при смене роли
+    sessions.set_state(chat_id, PendingState.NONE)
+
     if role == "Admin":
         # Если пользователь Admin, сразу меняем роль на Преподаватель
-        user_roles[chat_id] = "Teacher"
-        bot.send_message(chat_id, 'Роль изменена на Преподаватель.', reply_markup=create_keyboard_for_role("Teacher"))
+        sessions.set_role(chat_id, "Teacher")
+        sender.send_message(chat_id, 'Роль изменена на Преподаватель.', reply_markup=create_keyboard_for_role("Teacher"))
     else:
         # Если пользователь Преподаватель, запрашиваем пароль для Admin
-        bot.send_message(chat_id, 'Введите пароль для роли Admin:', reply_markup=create_keyboard_for_role(role))
-        pending_password[chat_id] = 'awaiting_admin_password'
+        sender.send_message(chat_id, 'Введите пароль для роли Admin:', reply_markup=create_keyboard_for_role(role))
+        sessions.set_state(chat_id, PendingState.ADMIN_PASSWORD)
 
 def handle_add_schedule(message: types.Message):
     """Обработчик команды добавления расписания"""
     chat_id = message.chat.id
-    role = user_roles.get(chat_id, "Teacher")
+    role = sessions.get_role(chat_id)
     if role != "Admin":
-        bot.send_message(chat_id, 'Эта команда доступна только для роли Admin.', reply_markup=create_keyboard_for_role(role))
+        sender.send_message(chat_id, 'Эта команда доступна только для роли Admin.', reply_markup=create_keyboard_for_role(role))
         return
-    bot.send_message(chat_id, 'Пожалуйста, отправьте Excel-файл с расписанием.', reply_markup=create_keyboard_for_role(role))
+    sender.send_message(chat_id, 'Пожалуйста, отправьте Excel-файл с расписанием.', reply_markup=create_keyboard_for_role(role))
 
 def handle_show_command(message: types.Message):
     """Обработчик команды /show"""
     chat_id = message.chat.id
-    role = user_roles.get(chat_id, "Teacher")
+    role = sessions.get_role(chat_id)
     if role != "Teacher":
-        bot.send_message(chat_id, 'Эта команда доступна только для роли Преподаватель.', reply_markup=create_keyboard_for_role(role))
+        sender.send_message(chat_id, 'Эта команда доступна только для роли Преподаватель.', reply_markup=create_keyboard_for_role(role))
         return
-    bot.send_message(chat_id, 'Введите фамилию преподавателя:', reply_markup=create_keyboard_for_role(role))
-    pending_users[chat_id] = 'awaiting_teacher_name'
+    sender.send_message(chat_id, 'Введите фамилию преподавателя:', reply_markup=create_keyboard_for_role(role))
+    sessions.set_state(chat_id, PendingState.TEACHER_NAME)
 
 def handle_show_schedule(message: types.Message):
     """Обработчик кнопки 'Показать расписание'"""
     chat_id = message.chat.id
-    role = user_roles.get(chat_id, "Teacher")
+    role = sessions.get_role(chat_id)
     if role != "Teacher":
-        bot.send_message(chat_id, 'Эта команда доступна только для роли Преподаватель.', reply_markup=create_keyboard_for_role(role))
+        sender.send_message(chat_id, 'Эта команда доступна только для роли Преподаватель.', reply_markup=create_keyboard_for_role(role))
         return
-    bot.send_message(chat_id, 'Введите фамилию преподавателя:', reply_markup=create_keyboard_for_role(role))
-    pending_users[chat_id] = 'awaiting_teacher_name'
+    sender.send_message(chat_id, 'Введите фамилию преподавателя:', reply_markup=create_keyboard_for_role(role))
+    sessions.set_state(chat_id, PendingState.TEACHER_NAME)
 
 @bot.message_handler(content_types=['text'])
 def handle_text(message: types.Message):
     chat_id = message.chat.id
+    state = sessions.get_state(chat_id)
 
     # Обработка ввода пароля для Admin (при входе)
-    if chat_id in pending_password and pending_password[chat_id] == 'awaiting_admin_password':
-        del pending_password[chat_id]
+    if state == PendingState.ADMIN_PASSWORD:
+        sessions.take_state(chat_id)
         password = message.text
         if check_admin_password(password):
-            user_roles[chat_id] = "Admin"
-            bot.send_message(chat_id, 'Роль изменена на Admin.', reply_markup=create_keyboard_for_role("Admin"))
+            sessions.set_role(chat_id, "Admin")
+            sender.send_message(chat_id, 'Роль изменена на Admin.', reply_markup=create_keyboard_for_role("Admin"))
         else:
-            bot.send_message(chat_id, 'Неверный пароль. Роль не изменена.', reply_markup=create_keyboard_for_role(user_roles[chat_id]))
+            sender.send_message(chat_id, 'Неверный пароль. Роль не изменена.', reply_markup=create_keyboard_for_role(sessions.get_role(chat_id)))
 
     # Обработка смены пароля для Admin
-    elif chat_id in pending_password and pending_password[chat_id] == 'awaiting_new_password':
-        del pending_password[chat_id]
+    elif state == PendingState.NEW_PASSWORD:
+        sessions.take_state(chat_id)
         new_password = message.text.strip()
         if not new_password:
-            bot.send_message(chat_id, 'Пароль не может быть пустым. Попробуйте снова.', reply_markup=create_keyboard_for_role("Admin"))
-            bot.send_message(chat_id, 'Введите новый пароль:', reply_markup=create_keyboard_for_role("Admin"))
-            pending_password[chat_id] = 'awaiting_new_password'
+            sender.send_message(chat_id, 'Пароль не может быть пустым. Попробуйте снова.', reply_markup=create_keyboard_for_role("Admin"))
+            sender.send_message(chat_id, 'Введите новый пароль:', reply_markup=create_keyboard_for_role("Admin"))
+            sessions.set_state(chat_id, PendingState.NEW_PASSWORD)
             return
         update_admin_password(new_password)
-        bot.send_message(chat_id, 'Пароль успешно изменен.', reply_markup=create_keyboard_for_role("Admin"))
+        sender.send_message(chat_id, 'Пароль успешно изменен.', reply_markup=create_keyboard_for_role("Admin"))
 
     # Обработка кнопки "Сменить роль"
     elif message.text == "Сменить роль":
@@ -201,185 +199,321 @@ def handle_text(message: types.Message):
 
     # Обработка кнопки "Сменить пароль"
     elif message.text == "Сменить пароль":
-        role = user_roles.get(chat_id, "Teacher")
+        role = sessions.get_role(chat_id)
         if role != "Admin":
-            bot.send_message(chat_id, 'Эта команда доступна только для роли Admin.', reply_markup=create_keyboard_for_role(role))
+            sender.send_message(chat_id, 'Эта команда доступна только для роли Admin.', reply_markup=create_keyboard_for_role(role))
             return
-        # Очищаем состояние перед запросом нового пароля
-        if chat_id in pending_password:
-            del pending_password[chat_id]
-        bot.send_message(chat_id, 'Введите новый пароль:', reply_markup=create_keyboard_for_role("Admin"))
-        pending_password[chat_id] = 'awaiting_new_password'
+        sender.send_message(chat_id, 'Введите новый пароль:', reply_markup=create_keyboard_for_role("Admin"))
+        sessions.set_state(chat_id, PendingState.NEW_PASSWORD)
 
     # Обработка ввода фамилии преподавателя
-    elif chat_id in pending_users and pending_users[chat_id] == 'awaiting_teacher_name':
-        del pending_users[chat_id]
+    elif state == PendingState.TEACHER_NAME:
+        sessions.take_state(chat_id)
         process_teacher_input(message)
 
+    # Обработка ввода фамилии для подписки на рассылку
+    elif state == PendingState.SUBSCRIBE_NAME:
+        sessions.take_state(chat_id)
+        process_subscribe_input(chat_id, message.text.strip())
+
 def process_teacher_input(message: types.Message):
     """Обработка ввода фамилии преподавателя"""
     teacher_name = message.text.strip()
     chat_id = message.chat.id
-    role = user_roles.get(chat_id, "Teacher")
+    role = sessions.get_role(chat_id)
 
-    data = load_existing_data()
-    if not data or not data.get("schedule_data"):
-        bot.send_message(chat_id, 'Расписание не найдено. Пожалуйста, добавьте файлы с расписанием.', reply_markup=create_keyboard_for_role(role))
-        pending_users[chat_id] = 'awaiting_teacher_name'
+    if schedule_index.is_empty():
+        sender.send_message(chat_id, 'Расписание не найдено. Пожалуйста, добавьте файлы с расписанием.', reply_markup=create_keyboard_for_role(role))
+        sessions.set_state(chat_id, PendingState.TEACHER_NAME)
         return
 
     # Получаем текущую дату и диапазон
-    current_date = datetime.now()
+    current_date = datetime.now().date()
     start_date = current_date - timedelta(days=14)  # -14 дней
     end_date = current_date + timedelta(days=28)    # +28 дней
-    current_year = current_date.year
-
-    teacher_entries = []
-    search_name = teacher_name.lower()
-
-    for item in data["schedule_data"]:
-        teacher = item.get('teacher', '').lower()
-        if not teacher:
-            continue
-
-        # Улучшенный поиск: извлекаем фамилию более надежно
-        teacher_parts = teacher.split()
-        teacher_clean = teacher_parts[-1] if teacher_parts else teacher
-        if teacher.startswith('доц.') or teacher.startswith('ст.преп.'):
-            teacher_clean = teacher_parts[1] if len(teacher_parts) > 1 else teacher_clean
-
-        # Проверяем совпадение
-        if (search_name in teacher or 
-            search_name in teacher_clean or
-            any(search_name in part for part in teacher_parts)):
-            # Преобразуем дату из строки DD.MM в объект datetime для текущего года и следующих 3 лет
-            try:
-                schedule_date_str = item['date']
-                entry_added = False
-                for year_offset in range(4):  # 2025, 2026, 2027, 2028
-                    year = current_year + year_offset
-                    schedule_date = datetime.strptime(schedule_date_str + f".{year}", '%d.%m.%Y')
-                    # Проверяем, попадает ли дата в диапазон
-                    if start_date <= schedule_date <= end_date:
-                        item['sort_date'] = schedule_date
-                        teacher_entries.append(item)
-                        entry_added = True
-                        break
-                if not entry_added:
-                    continue
-            except ValueError:
-                continue  # Пропускаем, если дата в неправильном формате
-
-    if not teacher_entries:
-        bot.send_message(chat_id, f'Преподаватель "{teacher_name}" не найден в расписании за указанный период.', reply_markup=create_keyboard_for_role(role))
-        pending_users[chat_id] = 'awaiting_teacher_name'
-        return
 
-    # Удаляем дубликаты
-    unique_entries = []
-    seen = set()
-    for entry in teacher_entries:
-        entry_tuple = (entry['date'], entry['teacher'], entry['subject'], entry['time'], entry['audience'], entry.get('type', ''))
-        if entry_tuple not in seen:
-            seen.add(entry_tuple)
-            unique_entries.append(entry)
-
-    # Сортируем записи по дате
-    unique_entries.sort(key=lambda x: x['sort_date'])
-
-    # Формируем сообщение с рамками и минимальной шириной
-    TELEGRAM_MESSAGE_LIMIT = 4096
-    schedule_messages = []
-    current_message = ""
-    min_width = 60  # Минимальная ширина для каждого поля
-
-    for item in unique_entries:
-        # Формируем содержимое блока
-        date_str = f"{item['date']}".ljust(min_width)
-        # Ограничиваем длину названия предмета и добавляем точку, если обрезается
-        subject = item['subject']
-        if len(subject) > min_width - 2:
-            subject = f"{subject[:min_width-5]}..."
-        subject_str = subject.ljust(min_width)
-        type_str = f"{item.get('type', '')}"[:min_width-5].ljust(min_width)
-        time_str = f"{item['time']}".ljust(min_width)
-        audience_str = f"Ауд. {item['audience']}".ljust(min_width)
-
-        # Создаем рамку для блока
-        block = (
-            f"╔{'═' * (min_width + 2)}╗\n"
-            f"║ {date_str} ║\n"
-            f"║ {subject_str} ║\n"
-            f"║ {type_str} ║\n"
-            f"║ {time_str} ║\n"
-            f"║ {audience_str} ║\n"
-            f"╚{'═' * (min_width + 2)}╝\n\n"
-        )
-
-        # Проверяем, не превысит ли добавление новой записи лимит
-        if len(current_message) + len(block) > TELEGRAM_MESSAGE_LIMIT:
-            schedule_messages.append(current_message)
-            current_message = block
-        else:
-            current_message += block
+    teacher = resolve_teacher(chat_id, teacher_name, role)
+    if teacher is None:
+        sessions.set_state(chat_id, PendingState.TEACHER_NAME)
+        return
 
-    # Добавляем последнее сообщение, если оно не пустое
-    if current_message:
-        schedule_messages.append(current_message)
+    # Отправляем только текущую неделю, остальные страницы формируются по кнопкам
+    if not schedule_index.find_entries(teacher, start_date, end_date):
+        sender.send_message(chat_id, f'Преподаватель "{teacher_name}" не найден в расписании за указанный период.', reply_markup=create_keyboard_for_role(role))
+        sessions.set_state(chat_id, PendingState.TEACHER_NAME)
+        return
 
-    # Отправляем сообщения
-    for msg in schedule_messages:
-        bot.send_message(chat_id, f"```\n{msg}\n```", parse_mode="Markdown", reply_markup=create_keyboard_for_role(role))
+    week = schedule_render.week_start(current_date)
+    sender.send_message(chat_id, schedule_render.get_week_page(teacher, week), parse_mode="Markdown",
+                        reply_markup=create_week_keyboard(teacher, week))
 
     # После вывода снова ожидаем ввод фамилии
-    bot.send_message(chat_id, 'Введите фамилию преподавателя:', reply_markup=create_keyboard_for_role(role))
-    pending_users[chat_id] = 'awaiting_teacher_name'
+    sender.send_message(chat_id, 'Введите фамилию преподавателя:', reply_markup=create_keyboard_for_role(role))
+    sessions.set_state(chat_id, PendingState.TEACHER_NAME)
+
+def resolve_teacher(chat_id, teacher_name: str, role):
+    """Ищет преподавателя по фамилии (с инициалами), началу фамилии, части имени или с учетом опечаток.
+    Возвращает ключ преподавателя или None, сообщив пользователю о неоднозначности или отсутствии"""
+    with metrics.stage('name_search'):
+        candidates = name_search.search(schedule_index.strip_titles(teacher_name))
+    matches = [key for key, kind in candidates if kind != name_search.FUZZY]
+    exact = [key for key, kind in candidates if kind == name_search.EXACT]
+    # Однофамильцы без уточняющих инициалов и несколько неточных совпадений требуют уточнения
+    if len(exact) > 1 or (len(matches) > 1 and not exact):
+        names = ', '.join(name_search.display_name(key) for key in (exact or matches))
+        sender.send_message(chat_id, f'Найдено несколько преподавателей: {names}. Уточните фамилию:', reply_markup=create_keyboard_for_role(role))
+        return None
+    if not matches and candidates:
+        names = ', '.join(name_search.display_name(key) for key, kind in candidates)
+        sender.send_message(chat_id, f'Преподаватель "{teacher_name}" не найден. Возможно, вы имели в виду: {names}?', reply_markup=create_keyboard_for_role(role))
+        return None
+    if not matches:
+        sender.send_message(chat_id, f'Преподаватель "{teacher_name}" не найден в расписании.', reply_markup=create_keyboard_for_role(role))
+        return None
+    return matches[0]
+
+def week_callback_data(teacher, week) -> str:
+    """Данные кнопки перехода к неделе: week:<порядковый номер понедельника>:<ключ преподавателя>"""
+    return f"week:{week.toordinal()}:{teacher}"
+
+def create_week_keyboard(teacher, week):
+    """Кнопки перехода к предыдущей и следующей неделе (только если там есть занятия)"""
+    first, last = schedule_index.date_bounds(teacher)
+    buttons = []
+    if first is not None and first < week:
+        buttons.append(types.InlineKeyboardButton('◀ Пред. неделя', callback_data=week_callback_data(teacher, week - timedelta(days=7))))
+    if last is not None and last >= week + timedelta(days=7):
+        buttons.append(types.InlineKeyboardButton('След. неделя ▶', callback_data=week_callback_data(teacher, week + timedelta(days=7))))
+    # Telegram ограничивает данные кнопки 64 байтами
+    buttons = [button for button in buttons if len(button.callback_data.encode('utf-8')) <= 64]
+    if not buttons:
+        return None
+    markup = types.InlineKeyboardMarkup()
+    markup.row(*buttons)
+    return markup
+
+def handle_week_callback(call: types.CallbackQuery):
+    """Переход к другой неделе: сообщение с расписанием редактируется на месте"""
+    _, ordinal, name = call.data.split(':', 2)
+    week = date.fromordinal(int(ordinal))
+    # Кнопки старых сообщений содержат только фамилию
+    teacher = schedule_index.known_teacher(name) or name
+    bot.answer_callback_query(call.id)
+    sender.edit_message_text(call.message.chat.id, call.message.message_id,
+                             schedule_render.get_week_page(teacher, week), parse_mode="Markdown",
+                             reply_markup=create_week_keyboard(teacher, week))
+
+def handle_subscribe(message: types.Message):
+    """Обработчик команды /subscribe [фамилия]"""
+    chat_id = message.chat.id
+    role = sessions.get_role(chat_id)
+    if role != "Teacher":
+        sender.send_message(chat_id, 'Эта команда доступна только для роли Преподаватель.', reply_markup=create_keyboard_for_role(role))
+        return
+    if not digest.DIGEST_TIME:
+        sender.send_message(chat_id, 'Ежедневная рассылка отключена.', reply_markup=create_keyboard_for_role(role))
+        return
+
+    args = message.text.split(maxsplit=1)[1:]
+    if args:
+        process_subscribe_input(chat_id, args[0].strip())
+        return
+    sender.send_message(chat_id, 'Введите фамилию преподавателя для ежедневной рассылки:', reply_markup=create_keyboard_for_role(role))
+    sessions.set_state(chat_id, PendingState.SUBSCRIBE_NAME)
+
+def process_subscribe_input(chat_id, teacher_name: str):
+    """Подписка чата на расписание преподавателя"""
+    role = sessions.get_role(chat_id)
+    teacher = resolve_teacher(chat_id, teacher_name, role)
+    if teacher is None:
+        sessions.set_state(chat_id, PendingState.SUBSCRIBE_NAME)
+        return
+    storage.save_subscription(chat_id, teacher)
+    sender.send_message(chat_id, f'✅ Расписание {name_search.display_name(teacher)} на следующий день будет приходить '
+                                 f'ежедневно в {digest.DIGEST_TIME}. Отписаться: /unsubscribe', reply_markup=create_keyboard_for_role(role))
+
+def handle_unsubscribe(message: types.Message):
+    """Обработчик команды /unsubscribe"""
+    chat_id = message.chat.id
+    role = sessions.get_role(chat_id)
+    if storage.delete_subscription(chat_id):
+        sender.send_message(chat_id, '✅ Подписка на рассылку отменена', reply_markup=create_keyboard_for_role(role))
+    else:
+        sender.send_message(chat_id, 'ℹ️ Подписки на рассылку нет', reply_markup=create_keyboard_for_role(role))
+
+def parse_day(text: str):
+    """Дата из аргумента команды: пусто или "сегодня", "завтра", ДД.ММ, ДД.ММ.ГГГГ"""
+    today = datetime.now().date()
+    text = text.strip().lower()
+    if text in ('', 'сегодня'):
+        return today
+    if text == 'завтра':
+        return today + timedelta(days=1)
+    return resolve_date(text)
+
+def handle_free_rooms(message: types.Message):
+    """Обработчик команды /free [дата] <номер пары>: свободные аудитории"""
+    chat_id = message.chat.id
+    role = sessions.get_role(chat_id)
+    args = message.text.split()[1:]
+    day = parse_day(' '.join(args[:-1])) if args else None
+    slot = int(args[-1]) - 1 if args and args[-1].isdigit() else -1
+    if day is None or not 0 <= slot < len(occupancy.SLOTS):
+        sender.send_message(chat_id, 'Укажите дату и номер пары, например: /free 20.10 3 или /free завтра 2', reply_markup=create_keyboard_for_role(role))
+        return
+    if not occupancy.room_counts:
+        sender.send_message(chat_id, 'Расписание не найдено. Пожалуйста, добавьте файлы с расписанием.', reply_markup=create_keyboard_for_role(role))
+        return
+
+    rooms = occupancy.free_rooms(day, slot)
+    text = f'Свободные аудитории {day:%d.%m.%Y}, {slot + 1} пара ({occupancy.slot_label(slot)}): {", ".join(rooms) or "нет"}'
+    if len(text) > schedule_render.TELEGRAM_MESSAGE_LIMIT:
+        text = text[:schedule_render.TELEGRAM_MESSAGE_LIMIT - 1] + '…'
+    sender.send_message(chat_id, text, reply_markup=create_keyboard_for_role(role))
+
+def handle_room_week(message: types.Message):
+    """Обработчик команды /room <аудитория> [дата]: занятость аудитории на неделю"""
+    chat_id = message.chat.id
+    role = sessions.get_role(chat_id)
+    args = message.text.split()[1:]
+    day = datetime.now().date()
+    # Последний аргумент - дата, если он на нее похож
+    if len(args) > 1 and parse_day(args[-1]) is not None:
+        day = parse_day(args.pop())
+    if not args:
+        sender.send_message(chat_id, 'Укажите аудиторию, например: /room 101 или /room 101 20.10', reply_markup=create_keyboard_for_role(role))
+        return
+
+    room = occupancy.find_room(' '.join(args))
+    if room is None:
+        sender.send_message(chat_id, f'Аудитория "{" ".join(args)}" не найдена в расписании.', reply_markup=create_keyboard_for_role(role))
+        return
+    sender.send_message(chat_id, schedule_render.render_room_week(room, schedule_render.week_start(day)),
+                        parse_mode="Markdown", reply_markup=create_keyboard_for_role(role))
+
+def handle_inline_query(inline_query: types.InlineQuery):
+    """Автодополнение фамилии преподавателя в inline-режиме"""
+    results = []
+    for i, (key, kind) in enumerate(name_search.search(schedule_index.strip_titles(inline_query.query), limit=10)):
+        full_name = name_search.display_name(key)
+        # Отправляется имя с инициалами, чтобы однофамильцы различались
+        results.append(types.InlineQueryResultArticle(
+            id=str(i),
+            title=full_name,
+            input_message_content=types.InputTextMessageContent(full_name)
+        ))
+    bot.answer_inline_query(inline_query.id, results, cache_time=60)
 
 def handle_document(message: types.Message):
     """Обработчик загрузки документа"""
     chat_id = message.chat.id
-    role = user_roles.get(chat_id, "Teacher")
+    role = sessions.get_role(chat_id)
     if role != "Admin":
-        bot.send_message(chat_id, 'Эта команда доступна только для роли Admin.', reply_markup=create_keyboard_for_role(role))
+        sender.send_message(chat_id, 'Эта команда доступна только для роли Admin.', reply_markup=create_keyboard_for_role(role))
         return
 
     file_name = message.document.file_name
     file_name_lower = file_name.lower()
 
+    # Архив с несколькими файлами разбирается и сохраняется одной загрузкой
+    if file_name_lower.endswith('.zip'):
+        sender.send_message(chat_id, f'⏳ Архив {file_name} принят в обработку', reply_markup=create_keyboard_for_role(role))
+        ingest.submit_archive_upload(message.document.file_id, file_name, lambda result: report_archive_result(chat_id, result))
+        return
+
     if not (file_name_lower.endswith('.xls') or file_name_lower.endswith('.xlsx')):
-        bot.send_message(chat_id, 'Пожалуйста, отправьте файл в формате Excel (.xls или .xlsx)', reply_markup=create_keyboard_for_role(role))
+        sender.send_message(chat_id, 'Пожалуйста, отправьте файл в формате Excel (.xls или .xlsx) или zip-архив с такими файлами', reply_markup=create_keyboard_for_role(role))
         return
 
-    file_info = bot.get_file(message.document.file_id)
-    downloaded_file = bot.download_file(file_info.file_path)
+    # Скачивание и разбор выполняются в пуле процессов, не блокируя обработку сообщений
+    sender.send_message(chat_id, f'⏳ Файл {file_name} принят в обработку', reply_markup=create_keyboard_for_role(role))
+    ingest.submit_upload(message.document.file_id, file_name, lambda result: report_upload_result(chat_id, file_name, result))
 
-    result = process_excel_file(downloaded_file, file_name)
+def report_upload_result(chat_id, file_name, result):
+    """Отправляет администратору итог обработки файла"""
+    role = sessions.get_role(chat_id)
 
     if result["status"] == "error":
-        bot.send_message(chat_id, f'❌ {result["message"]}', reply_markup=create_keyboard_for_role(role))
+        sender.send_message(chat_id, f'❌ {result["message"]}', reply_markup=create_keyboard_for_role(role))
         return
 
-    if result["new_entries_count"] == 0:
-        bot.send_message(chat_id, '✅ Файл обработан, но новых записей не найдено', reply_markup=create_keyboard_for_role(role))
+    if result["unchanged"]:
+        sender.send_message(chat_id, f'✅ Файл {file_name} не изменился с прошлой загрузки', reply_markup=create_keyboard_for_role(role))
+    elif result["new_entries_count"] == 0 and result["removed_entries_count"] == 0 and result["archived_entries_count"] == 0:
+        sender.send_message(chat_id, '✅ Файл обработан, но новых записей не найдено', reply_markup=create_keyboard_for_role(role))
     else:
-        save_data(result["data"])
-        report = f"✅ Файл {file_name} успешно обработан"
-        bot.send_message(chat_id, report, reply_markup=create_keyboard_for_role(role))
+        report = f"✅ Файл {file_name} успешно обработан: {describe_changes(result)}"
+        sender.send_message(chat_id, report, reply_markup=create_keyboard_for_role(role))
+
+def describe_changes(report) -> str:
+    """Краткое описание изменений файла"""
+    if report["unchanged"]:
+        return 'без изменений'
+    description = (f'изменено листов {report["changed_sheets_count"]}, '
+                   f'добавлено записей {report["new_entries_count"]}, удалено {report["removed_entries_count"]}')
+    if report["archived_entries_count"]:
+        description += f', добавлено в архив прошедших семестров {report["archived_entries_count"]}'
+    return description
+
+def report_archive_result(chat_id, result):
+    """Отправляет администратору сводный отчет по архиву"""
+    role = sessions.get_role(chat_id)
+
+    if result["status"] == "error":
+        sender.send_message(chat_id, f'❌ {result["message"]}', reply_markup=create_keyboard_for_role(role))
+        return
+
+    files = result["files"]
+    failed = sum(1 for report in files if report["error"] is not None)
+    lines = [f'✅ Архив {result["archive_name"]} обработан: файлов {len(files) - failed} из {len(files)}, '
+             f'добавлено записей {result["new_entries_count"]}, удалено {result["removed_entries_count"]}']
+    for report in files:
+        if report["error"] is not None:
+            lines.append(f'❌ {report["file_name"]}: {report["error"]}')
+        else:
+            lines.append(f'• {report["file_name"]}: {describe_changes(report)}')
+
+    # Длинный отчет делим на несколько сообщений по строкам
+    chunk = ''
+    for line in lines:
+        if chunk and len(chunk) + len(line) + 1 > schedule_render.TELEGRAM_MESSAGE_LIMIT:
+            sender.send_message(chat_id, chunk, reply_markup=create_keyboard_for_role(role))
+            chunk = ''
+        chunk = f'{chunk}\n{line}' if chunk else line
+    sender.send_message(chat_id, chunk, reply_markup=create_keyboard_for_role(role))
 
 def handle_clear_schedule(message: types.Message):
-    """Обработчик удаления расписания"""
+    """Обработчик удаления расписания: /clear - все данные, /clear ГГГГ-1 или ГГГГ-2 - один семестр"""
     chat_id = message.chat.id
-    role = user_roles.get(chat_id, "Teacher")
+    role = sessions.get_role(chat_id)
     if role != "Admin":
-        bot.send_message(chat_id, 'Эта команда доступна только для роли Admin.', reply_markup=create_keyboard_for_role(role))
+        sender.send_message(chat_id, 'Эта команда доступна только для роли Admin.', reply_markup=create_keyboard_for_role(role))
         return
 
-    file_path = 'data/schedule.json'
-    if os.path.exists(file_path):
-        os.remove(file_path)
-        bot.reply_to(message, '✅ Файл расписания успешно удален', reply_markup=create_keyboard_for_role(role))
+    args = message.text.split()[1:] if message.text.startswith('/') else []
+    if args:
+        term = parse_term(args[0])
+        if term is None:
+            sender.reply_to(message, 'Укажите семестр в формате ГГГГ-1 (осенний) или ГГГГ-2 (весенний), например: /clear 2024-2', reply_markup=create_keyboard_for_role(role))
+        elif ingest.clear_term(term):
+            sender.reply_to(message, f'✅ Расписание за {term_label(term)} удалено', reply_markup=create_keyboard_for_role(role))
+        else:
+            sender.reply_to(message, f'ℹ️ Расписания за {term_label(term)} нет', reply_markup=create_keyboard_for_role(role))
+        return
+
+    if ingest.clear_schedule():
+        sender.reply_to(message, '✅ Файл расписания успешно удален', reply_markup=create_keyboard_for_role(role))
     else:
-        bot.reply_to(message, 'ℹ️ Файл расписания не найден (уже удален или не создавался)', reply_markup=create_keyboard_for_role(role))
+        sender.reply_to(message, 'ℹ️ Файл расписания не найден (уже удален или не создавался)', reply_markup=create_keyboard_for_role(role))
+
+def initialize_schedule_index():
+    """Загрузка индекса из снимка, а если снимок устарел - построение по данным хранилища"""
+    schedule_index.set_archive_state(*storage.load_archive_state())
+    data_version = storage.load_data_version()
+    if schedule_index.load_snapshot(data_version):
+        return
+    schedule_index.build_index(load_existing_data()["schedule_data"])
+    schedule_index.save_snapshot(data_version)
 
 # Инициализация шифрования при запуске
-initialize_encryption()
\ No newline at end of file
+initialize_encryption()
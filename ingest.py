@@ -0,0 +1,453 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import requests
+from telebot import apihelper
+from bot import bot
+import storage
+import schedule_index
+import schedule_render
+import metrics
+import file_processing
+from file_processing import (
+    parse_excel_sheets, prepare_revision, select_new_entries, forget_entry_keys, remember_entry_keys, clear_data
+)
+
+logger = logging.getLogger(__name__)
+
+# Число процессов для скачивания и разбора файлов
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Разбирать листы одного файла в разных процессах (выгодно для файлов с большими листами)
+PARALLEL_SHEETS = os.getenv("INGEST_PARALLEL_SHEETS", "0") == "1"
+# Ограничения для архивов: число файлов Excel и их суммарный размер после распаковки
+MAX_ARCHIVE_FILES = int(os.getenv("MAX_ARCHIVE_FILES", "200"))
+MAX_ARCHIVE_BYTES = int(os.getenv("MAX_ARCHIVE_MB", "200")) * 1024 * 1024
+
+# Предельный размер загружаемого файла; файл скачивается во временный файл блоками
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+# Тайм-ауты соединения и чтения при скачивании
+DOWNLOAD_TIMEOUT = (10, 60)
+DEFAULT_FILE_URL = "https://api.telegram.org/file/bot{0}/{1}"
+
+EXCEL_EXTENSIONS = ('.xls', '.xlsx')
+
+# Записи старше этого срока переносятся из основной базы в архивные шарды по семестрам;
+# 0 отключает перенос
+RETENTION_DAYS = int(os.getenv("SCHEDULE_RETENTION_DAYS", "180"))
+COMPACTION_INTERVAL_SECONDS = 24 * 3600
+
+# Пул процессов создается при первой загрузке
+process_pool = None
+process_pool_lock = threading.Lock()
+# Потоки, ожидающие результатов пула и фиксирующие их в хранилище
+coordinator = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='ingest')
+# Фиксация данных в хранилище выполняется строго по одной
+commit_lock = threading.Lock()
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Возвращает пул процессов для разбора файлов"""
+    global process_pool
+    with process_pool_lock:
+        if process_pool is None:
+            # spawn: процесс бота многопоточный, fork для него небезопасен
+            process_pool = ProcessPoolExecutor(
+                max_workers=INGEST_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return process_pool
+
+def upload_too_large_message() -> str:
+    """Сообщение о превышении предельного размера файла"""
+    return f"Файл больше допустимых {MAX_UPLOAD_BYTES // (1024 * 1024)} МБ"
+
+def spool_stream(chunks, suffix: str) -> str:
+    """Записывает поток блоков во временный файл, соблюдая MAX_UPLOAD_BYTES. Возвращает путь к файлу"""
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        size = 0
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise ValueError(upload_too_large_message())
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+def download_to_file(file_id: str, suffix: str) -> tuple:
+    """Скачивает файл из Telegram по частям во временный файл, не загружая его в память целиком
+    (выполняется в рабочем процессе)"""
+    with metrics.collect_stages() as stages:
+        with metrics.stage('get_file'):
+            file_info = bot.get_file(file_id)
+        if file_info.file_size and file_info.file_size > MAX_UPLOAD_BYTES:
+            raise ValueError(upload_too_large_message())
+        with metrics.stage('download_file'):
+            url = (apihelper.FILE_URL or DEFAULT_FILE_URL).format(bot.token, file_info.file_path)
+            with requests.get(url, stream=True, proxies=apihelper.proxy, timeout=DOWNLOAD_TIMEOUT) as response:
+                if response.status_code != 200:
+                    raise apihelper.ApiHTTPException('Download file', response)
+                path = spool_stream(response.iter_content(DOWNLOAD_CHUNK_BYTES), suffix)
+    return path, stages
+
+def download_and_prepare(file_id: str, file_name: str) -> tuple:
+    """Скачивает файл из Telegram, сравнивает его с сохраненной версией и разбирает измененные листы
+    (выполняется в рабочем процессе). Возвращает изменение файла и длительности этапов"""
+    path, stages = download_to_file(file_id, os.path.splitext(file_name)[1])
+    try:
+        with metrics.collect_stages() as parse_stages:
+            revision = prepare_revision(path, file_name)
+    finally:
+        os.remove(path)
+    return revision, stages + parse_stages
+
+def member_file_name(info: zipfile.ZipInfo) -> str:
+    """Имя файла из архива без каталогов. Имена без флага UTF-8 архиваторы Windows пишут в cp866"""
+    name = info.filename
+    if not info.flag_bits & 0x800:
+        try:
+            name = name.encode('cp437').decode('cp866')
+        except UnicodeError:
+            pass
+    return name.replace('\\', '/').rsplit('/', 1)[-1]
+
+def list_archive_members(archive_path: str) -> list:
+    """Файлы Excel в архиве: [(путь в архиве, имя файла)]"""
+    with zipfile.ZipFile(archive_path) as archive:
+        members = [
+            (info, member_file_name(info)) for info in archive.infolist()
+            if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+        ]
+    members = [
+        (info, file_name) for info, file_name in members
+        if file_name.lower().endswith(EXCEL_EXTENSIONS) and not file_name.startswith(('.', '~$'))
+    ]
+    if len(members) > MAX_ARCHIVE_FILES:
+        raise ValueError(f"В архиве больше {MAX_ARCHIVE_FILES} файлов Excel")
+    if sum(info.file_size for info, file_name in members) > MAX_ARCHIVE_BYTES:
+        raise ValueError(f"Размер файлов в архиве превышает {MAX_ARCHIVE_BYTES // (1024 * 1024)} МБ")
+    return [(info.filename, file_name) for info, file_name in members]
+
+def extract_archive_member(archive_path: str, member: str) -> str:
+    """Распаковывает файл из архива во временный файл по частям. Возвращает путь к файлу"""
+    with zipfile.ZipFile(archive_path) as archive, archive.open(member) as f:
+        return spool_stream(iter(lambda: f.read(DOWNLOAD_CHUNK_BYTES), b''), os.path.splitext(member)[1])
+
+def prepare_archive_member(archive_path: str, member: str, file_name: str, parse: bool) -> tuple:
+    """Сравнивает файл из архива с сохраненной версией (выполняется в рабочем процессе)"""
+    with metrics.collect_stages() as stages:
+        path = extract_archive_member(archive_path, member)
+        try:
+            revision = prepare_revision(path, file_name, parse)
+        finally:
+            os.remove(path)
+    return revision, stages
+
+def parse_archive_member(archive_path: str, member: str, file_name: str, sheet_names: list) -> tuple:
+    """Разбирает отдельные листы файла из архива (выполняется в рабочем процессе)"""
+    with metrics.collect_stages() as stages:
+        path = extract_archive_member(archive_path, member)
+        try:
+            sheets = parse_excel_sheets(path, file_name, sheet_names)
+        finally:
+            os.remove(path)
+    return sheets, stages
+
+def record_worker_stages(stages):
+    """Учитывает этапы, замеренные в рабочем процессе"""
+    for stage_name, seconds in stages:
+        metrics.record_stage(stage_name, seconds)
+
+def is_archived(entry, archived_before) -> bool:
+    """Дата записи раньше границы архива"""
+    full_date = entry.get('full_date')
+    return archived_before is not None and full_date is not None and date.fromisoformat(full_date) < archived_before
+
+def diff_revision(revision: dict, upload_keys: set) -> tuple:
+    """Сравнивает записи измененных листов с прежней версией файла.
+    Возвращает удаляемые записи [(id, запись)], новые записи и записи для архива (даты до границы архива)"""
+    stored_sheets = storage.load_file_state(revision["file_name"])[1]
+    # Листы, которые не удалось разобрать, сохраняют прежний хэш и записи
+    for sheet in revision["changed_sheets"]:
+        if sheet not in revision["sheets"]:
+            if sheet in stored_sheets:
+                revision["sheet_hashes"][sheet] = stored_sheets[sheet]
+            else:
+                revision["sheet_hashes"].pop(sheet, None)
+
+    replaced_sheets = list(revision["sheets"]) + revision["removed_sheets"]
+    old_entries = storage.load_source_entries(revision["file_name"], replaced_sheets)
+    new_entries = [entry for entries in revision["sheets"].values() for entry in entries]
+    # Записи прошедших семестров сравниваются не с основной базой, а добавляются в архив
+    archived_before = schedule_index.archived_before
+    archived = [entry for entry in new_entries if is_archived(entry, archived_before)]
+    new_entries = [entry for entry in new_entries if not is_archived(entry, archived_before)]
+    old_rows = {storage.entry_to_row(entry) for entry_id, entry in old_entries}
+    new_rows = {storage.entry_to_row(entry) for entry in new_entries}
+
+    removed = [(entry_id, entry) for entry_id, entry in old_entries if storage.entry_to_row(entry) not in new_rows]
+    # Ключи удаляемых записей освобождаются, чтобы исправленные строки с тем же ключом были добавлены
+    forget_entry_keys(entry for entry_id, entry in removed)
+    added = select_new_entries([entry for entry in new_entries if storage.entry_to_row(entry) not in old_rows], upload_keys)
+    return removed, added, archived
+
+def commit_revisions(revisions: list) -> list:
+    """Применяет изменения файлов: записи измененных листов заменяются по разнице с прежней версией,
+    неизмененные файлы пропускаются. Все файлы проходят один отбор новых записей и одну транзакцию"""
+    with commit_lock, metrics.stage('commit'):
+        upload_keys = set()
+        changes = []
+        removed_entries = []
+        new_entries = []
+        try:
+            for revision in revisions:
+                if revision.get("error"):
+                    continue
+                base_hash = storage.load_file_state(revision["file_name"])[0]
+                if base_hash != revision["base_hash"]:
+                    revision["error"] = 'файл изменился во время обработки, загрузите его повторно'
+                    continue
+                if revision["file_hash"] == base_hash:
+                    revision["unchanged"] = True
+                    continue
+                removed, added, archived = diff_revision(revision, upload_keys)
+                revision["removed_entries_count"] = len(removed)
+                revision["new_entries_count"] = len(added)
+                revision["archived_entries"] = archived
+                changes.append({
+                    "file_name": revision["file_name"],
+                    "file_hash": revision["file_hash"],
+                    "sheet_hashes": revision["sheet_hashes"],
+                    "removed_ids": [entry_id for entry_id, entry in removed],
+                    "new_entries": added
+                })
+                removed_entries.extend(entry for entry_id, entry in removed)
+                new_entries.extend(added)
+
+            if changes:
+                with metrics.stage('save_data'):
+                    # Архив пополняется первым: если основная транзакция не пройдет, повторная
+                    # загрузка файла пропустит уже добавленные в архив записи
+                    for revision in revisions:
+                        if revision.get("archived_entries"):
+                            revision["archived_entries_count"] = storage.archive_new_entries(
+                                revision["file_name"], revision.pop("archived_entries"))
+                    storage.apply_revisions(changes)
+        except Exception:
+            # Множество ключей могло разойтись с хранилищем: при следующем обращении загрузим его заново
+            file_processing.entry_keys = None
+            raise
+
+        remember_entry_keys(new_entries)
+        if removed_entries:
+            schedule_index.remove_entries(removed_entries)
+        if new_entries:
+            schedule_index.add_entries(new_entries)
+        archived_count = sum(revision.get("archived_entries_count", 0) for revision in revisions)
+        if archived_count:
+            # Записи прошедших семестров могли сдвинуть первые даты преподавателей в архиве
+            schedule_index.set_archive_state(*storage.load_archive_state())
+        if removed_entries or new_entries or archived_count:
+            schedule_render.invalidate_cache()
+            metrics.inc('entries_ingested_total', len(new_entries) + archived_count)
+        if changes:
+            save_index_snapshot()
+        return revisions
+
+def save_index_snapshot():
+    """Сохраняет снимок индекса после изменения данных (вызывается под commit_lock).
+    Если удаленных строк накопилось много, таблица сначала перестраивается"""
+    if schedule_index.needs_compaction():
+        with metrics.stage('compact_table'):
+            schedule_index.compact_table()
+    try:
+        with metrics.stage('save_snapshot'):
+            schedule_index.save_snapshot(storage.load_data_version())
+    except Exception as e:
+        # Без снимка бот при следующем запуске построит индекс по хранилищу
+        logger.warning("Не удалось сохранить снимок индекса: %s", e)
+
+def revision_report(revision: dict) -> dict:
+    """Итог обработки файла для отчета администратору"""
+    return {
+        "file_name": revision["file_name"],
+        "error": revision.get("error"),
+        "unchanged": revision.get("unchanged", False),
+        "changed_sheets_count": len(revision.get("sheets", {})) + len(revision.get("removed_sheets", [])),
+        "new_entries_count": revision.get("new_entries_count", 0),
+        "removed_entries_count": revision.get("removed_entries_count", 0),
+        "archived_entries_count": revision.get("archived_entries_count", 0)
+    }
+
+def run_upload(file_id: str, file_name: str) -> dict:
+    """Полный цикл обработки загруженного файла"""
+    try:
+        with metrics.operation('upload', 'document'):
+            revision, stages = get_process_pool().submit(download_and_prepare, file_id, file_name).result()
+            record_worker_stages(stages)
+            report = revision_report(commit_revisions([revision])[0])
+            if report["error"]:
+                return {
+                    "status": "error",
+                    "message": f"Файл {file_name}: {report['error']}"
+                }
+            return {"status": "success", **report}
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+
+def submit_upload(file_id: str, file_name: str, on_done):
+    """Ставит файл в очередь обработки; on_done(result) вызывается по завершении"""
+    future = coordinator.submit(run_upload, file_id, file_name)
+    future.add_done_callback(lambda f: on_done(f.result()))
+
+def parse_archive(archive_path: str) -> list:
+    """Сравнивает файлы архива с сохраненными версиями и разбирает измененные листы в пуле процессов.
+    Возвращает изменения файлов в порядке архива"""
+    pool = get_process_pool()
+    pending = []
+    seen_names = set()
+    for member, file_name in list_archive_members(archive_path):
+        if file_name in seen_names:
+            pending.append(({"file_name": file_name, "error": 'файл с таким именем уже есть в архиве'}, None, None))
+            continue
+        seen_names.add(file_name)
+        # При разборе по листам рабочий процесс только сравнивает хэши, листы разбираются отдельными задачами
+        future = pool.submit(prepare_archive_member, archive_path, member, file_name, not PARALLEL_SHEETS)
+        pending.append(({"file_name": file_name, "error": None}, member, future))
+
+    revisions = []
+    sheet_futures = []
+    for placeholder, member, future in pending:
+        if future is None:
+            revisions.append(placeholder)
+            continue
+        try:
+            revision, stages = future.result()
+            record_worker_stages(stages)
+        except Exception as e:
+            placeholder["error"] = str(e) or type(e).__name__
+            revisions.append(placeholder)
+            continue
+        revisions.append(revision)
+        if PARALLEL_SHEETS:
+            for sheet_name in revision["changed_sheets"]:
+                sheet_futures.append((revision, pool.submit(
+                    parse_archive_member, archive_path, member, revision["file_name"], [sheet_name])))
+
+    for revision, future in sheet_futures:
+        try:
+            sheets, stages = future.result()
+            record_worker_stages(stages)
+            revision["sheets"].update(sheets)
+        except Exception as e:
+            revision["error"] = str(e) or type(e).__name__
+    return revisions
+
+def run_archive_upload(file_id: str, archive_name: str) -> dict:
+    """Полный цикл обработки архива с файлами расписания"""
+    archive_path = None
+    try:
+        with metrics.operation('upload', 'archive'):
+            archive_path, stages = get_process_pool().submit(download_to_file, file_id, '.zip').result()
+            record_worker_stages(stages)
+            revisions = parse_archive(archive_path)
+            if not revisions:
+                return {
+                    "status": "error",
+                    "message": f"В архиве {archive_name} нет файлов Excel (.xls или .xlsx)"
+                }
+            files = [revision_report(revision) for revision in commit_revisions(revisions)]
+            return {
+                "status": "success",
+                "archive_name": archive_name,
+                "files": files,
+                "new_entries_count": sum(report["new_entries_count"] for report in files),
+                "removed_entries_count": sum(report["removed_entries_count"] for report in files)
+            }
+    except zipfile.BadZipFile:
+        return {
+            "status": "error",
+            "message": f"Файл {archive_name} не является zip-архивом"
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    finally:
+        if archive_path:
+            os.remove(archive_path)
+
+def submit_archive_upload(file_id: str, archive_name: str, on_done):
+    """Ставит архив в очередь обработки; on_done(result) вызывается по завершении"""
+    future = coordinator.submit(run_archive_upload, file_id, archive_name)
+    future.add_done_callback(lambda f: on_done(f.result()))
+
+def clear_schedule() -> bool:
+    """Удаляет все данные расписания, не пересекаясь с фиксацией загрузок"""
+    with commit_lock:
+        schedule_index.clear_index()
+        schedule_render.invalidate_cache()
+        has_data = clear_data()
+        schedule_index.set_archive_state(None, {})
+        save_index_snapshot()
+        return has_data
+
+def clear_term(term: str) -> bool:
+    """Удаляет данные одного семестра: записи основной базы и архивный шард"""
+    with commit_lock:
+        removed, has_data = storage.clear_term(term)
+        forget_entry_keys(removed)
+        schedule_index.remove_entries(removed)
+        schedule_index.set_archive_state(*storage.load_archive_state())
+        schedule_render.invalidate_cache()
+        save_index_snapshot()
+        return has_data
+
+def compact_schedule(today=None) -> int:
+    """Переносит записи старше RETENTION_DAYS в архивные шарды и убирает их из резидентного индекса.
+    Возвращает число перенесенных записей"""
+    archived_before = (today or date.today()) - timedelta(days=RETENTION_DAYS)
+    with commit_lock, metrics.operation('job', 'compaction'):
+        moved = storage.archive_entries(archived_before)
+        if moved:
+            forget_entry_keys(moved)
+            schedule_index.remove_entries(moved)
+            # Перенесенные строки физически убираем из таблицы, иначе она не уменьшится
+            schedule_index.compact_table()
+        schedule_index.set_archive_state(*storage.load_archive_state())
+        if moved:
+            schedule_render.invalidate_cache()
+            save_index_snapshot()
+    if moved:
+        logger.info("В архив перенесено записей: %s (даты до %s)", len(moved), archived_before)
+    return len(moved)
+
+def compaction_loop():
+    """Раз в сутки переносит устаревшие записи в архив"""
+    while True:
+        try:
+            compact_schedule()
+        except Exception as e:
+            logger.error("Не удалось перенести записи в архив: %s", e)
+        time.sleep(COMPACTION_INTERVAL_SECONDS)
+
+def start_compaction():
+    """Запускает поток переноса в архив, если задан срок хранения"""
+    if RETENTION_DAYS <= 0:
+        return None
+    thread = threading.Thread(target=compaction_loop, name='compaction', daemon=True)
+    thread.start()
+    return thread
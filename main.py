@@ -1,6 +1,9 @@
 import os
 from dotenv import load_dotenv
 from telebot import TeleBot
+from metrics import instrument_handler, start_metrics_server
+from digest import start_scheduler
+from ingest import start_compaction
 from handlers import (
     handle_start,
     handle_add_schedule,
@@ -8,7 +11,14 @@ from handlers import (
     handle_document,
     handle_clear_schedule,
     handle_show_command,
-    handle_text
+    handle_text,
+    handle_inline_query,
+    handle_week_callback,
+    handle_subscribe,
+    handle_unsubscribe,
+    handle_free_rooms,
+    handle_room_week,
+    initialize_schedule_index
 )
 
 # Загрузка переменных окружения
@@ -18,17 +28,34 @@ TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 # Создание экземпляра бота
 bot = TeleBot(TOKEN)
 
-# Регистрация обработчиков
-bot.register_message_handler(handle_start, commands=['start'])
-bot.register_message_handler(handle_show_command, commands=['show'])
-bot.register_message_handler(handle_add_schedule, commands=['add'])
-bot.register_message_handler(handle_clear_schedule, commands=['clear'])
-bot.register_message_handler(handle_add_schedule, func=lambda message: message.text == 'Добавить расписание')
-bot.register_message_handler(handle_show_schedule, func=lambda message: message.text == 'Показать расписание')
-bot.register_message_handler(handle_clear_schedule, func=lambda message: message.text == 'Удалить файлы расписания')
-bot.register_message_handler(handle_document, content_types=['document'])
-bot.register_message_handler(handle_text, content_types=['text'])
+def register_handlers(bot, wrap=lambda handler: handler):
+    """Регистрация обработчиков; wrap позволяет обернуть каждый обработчик"""
+    bot.register_message_handler(wrap(handle_start), commands=['start'])
+    bot.register_message_handler(wrap(handle_show_command), commands=['show'])
+    bot.register_message_handler(wrap(handle_add_schedule), commands=['add'])
+    bot.register_message_handler(wrap(handle_clear_schedule), commands=['clear'])
+    bot.register_message_handler(wrap(handle_subscribe), commands=['subscribe'])
+    bot.register_message_handler(wrap(handle_unsubscribe), commands=['unsubscribe'])
+    bot.register_message_handler(wrap(handle_free_rooms), commands=['free'])
+    bot.register_message_handler(wrap(handle_room_week), commands=['room'])
+    bot.register_message_handler(wrap(handle_add_schedule), func=lambda message: message.text == 'Добавить расписание')
+    bot.register_message_handler(wrap(handle_show_schedule), func=lambda message: message.text == 'Показать расписание')
+    bot.register_message_handler(wrap(handle_clear_schedule), func=lambda message: message.text == 'Удалить файлы расписания')
+    bot.register_message_handler(wrap(handle_document), content_types=['document'])
+    bot.register_message_handler(wrap(handle_text), content_types=['text'])
+    bot.register_inline_handler(wrap(handle_inline_query), func=lambda query: True)
+    bot.register_callback_query_handler(wrap(handle_week_callback), func=lambda call: (call.data or '').startswith('week:'))
+
+# Регистрация обработчиков со сбором метрик
+register_handlers(bot, wrap=instrument_handler)
 
 # Запуск бота
 if __name__ == '__main__':
+    # Построение индекса преподавателей при запуске
+    initialize_schedule_index()
+    start_metrics_server()
+    # Ежедневная рассылка подписчикам
+    start_scheduler()
+    # Перенос устаревших записей в архив
+    start_compaction()
     bot.polling(none_stop=True)
\ No newline at end of file
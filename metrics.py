@@ -0,0 +1,201 @@
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'schedule_bot_'
+
+# Порт HTTP-эндпоинта /metrics на localhost; пустое значение отключает эндпоинт
+METRICS_PORT = os.getenv("METRICS_PORT", "9108")
+# Операции дольше этого порога попадают в журнал с разбивкой по этапам
+SLOW_OPERATION_SECONDS = float(os.getenv("SLOW_HANDLER_SECONDS", "1.0"))
+
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Описание метрик: имя -> (тип, описание)
+METRICS = {
+    'updates_total': ('counter', 'Полученные обновления по типам'),
+    'operation_seconds': ('histogram', 'Длительность обработчиков и загрузок'),
+    'stage_seconds': ('histogram', 'Длительность этапов обработки'),
+    'inflight': ('gauge', 'Число выполняемых операций'),
+    'entries_ingested_total': ('counter', 'Добавленные записи расписания'),
+    'schedule_cache_total': ('counter', 'Обращения к кэшу расписаний'),
+    'messages_sent_total': ('counter', 'Отправленные сообщения'),
+    'send_errors_total': ('counter', 'Ошибки отправки сообщений'),
+    'digests_sent_total': ('counter', 'Чаты, получившие ежедневную рассылку'),
+}
+
+counters = {}
+gauges = {}
+# (имя, метки) -> [счетчики по корзинам, сумма, количество]
+histograms = {}
+metrics_lock = threading.Lock()
+
+# Этапы текущей операции потока
+local = threading.local()
+
+def label_key(labels: dict) -> tuple:
+    """Ключ набора меток"""
+    return tuple(sorted(labels.items()))
+
+def inc(name: str, value: float = 1, **labels):
+    """Увеличивает счетчик"""
+    key = (name, label_key(labels))
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + value
+
+def gauge_add(name: str, delta: float, **labels):
+    """Изменяет значение индикатора"""
+    key = (name, label_key(labels))
+    with metrics_lock:
+        gauges[key] = gauges.get(key, 0) + delta
+
+def observe(name: str, value: float, **labels):
+    """Добавляет наблюдение в гистограмму"""
+    key = (name, label_key(labels))
+    with metrics_lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * len(HISTOGRAM_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if value <= bound:
+                histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+def record_stage(name: str, seconds: float):
+    """Учитывает этап, длительность которого уже измерена (например, в рабочем процессе)"""
+    observe('stage_seconds', seconds, stage=name)
+    stages = getattr(local, 'stages', None)
+    if stages:
+        stages[-1].append((name, seconds))
+
+@contextmanager
+def stage(name: str):
+    """Замеряет этап текущей операции"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+def timed(name: str):
+    """Декоратор: замеряет вызов функции как этап"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def collect_stages():
+    """Собирает этапы, выполненные внутри блока, в список [(этап, секунды)]"""
+    if not hasattr(local, 'stages'):
+        local.stages = []
+    collected = []
+    local.stages.append(collected)
+    try:
+        yield collected
+    finally:
+        local.stages.pop()
+
+@contextmanager
+def operation(kind: str, name: str):
+    """Замеряет операцию: длительность, число выполняемых и журнал медленных операций"""
+    gauge_add('inflight', 1, kind=kind)
+    start = time.perf_counter()
+    try:
+        with collect_stages() as stages:
+            yield
+    finally:
+        duration = time.perf_counter() - start
+        gauge_add('inflight', -1, kind=kind)
+        observe('operation_seconds', duration, kind=kind, operation=name)
+        if duration >= SLOW_OPERATION_SECONDS:
+            details = ', '.join(f"{stage_name}={seconds:.3f}s" for stage_name, seconds in stages) or 'нет данных'
+            logger.warning("Медленная операция %s %s: %.3fs (этапы: %s)", kind, name, duration, details)
+
+def update_type(update) -> str:
+    """Тип обновления для счетчика"""
+    return getattr(update, 'content_type', None) or type(update).__name__.lower()
+
+def instrument_handler(handler):
+    """Оборачивает обработчик бота сбором метрик"""
+    @functools.wraps(handler)
+    def wrapper(update):
+        inc('updates_total', type=update_type(update))
+        with operation('handler', handler.__name__):
+            return handler(update)
+    return wrapper
+
+def escape_label(value) -> str:
+    """Экранирует значение метки"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels, extra=()) -> str:
+    """Формирует блок меток {key=\"value\"}"""
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in pairs) + '}'
+
+def render() -> str:
+    """Формирует метрики в текстовом формате Prometheus"""
+    with metrics_lock:
+        snapshot = {
+            'counter': dict(counters),
+            'gauge': dict(gauges),
+            'histogram': {key: (list(value[0]), value[1], value[2]) for key, value in histograms.items()}
+        }
+
+    lines = []
+    for name, (metric_type, description) in METRICS.items():
+        full_name = PREFIX + name
+        lines.append(f"# HELP {full_name} {description}")
+        lines.append(f"# TYPE {full_name} {metric_type}")
+        for (metric_name, labels), value in sorted(snapshot[metric_type].items()):
+            if metric_name != name:
+                continue
+            if metric_type != 'histogram':
+                lines.append(f"{full_name}{format_labels(labels)} {value}")
+                continue
+            buckets, total, count = value
+            for bound, bucket_count in zip(HISTOGRAM_BUCKETS, buckets):
+                lines.append(f"{full_name}_bucket{format_labels(labels, [('le', bound)])} {bucket_count}")
+            lines.append(f"{full_name}_bucket{format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{full_name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{full_name}_count{format_labels(labels)} {count}")
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Отдает метрики по GET /metrics"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server():
+    """Запускает эндпоинт /metrics на localhost, если задан METRICS_PORT"""
+    if not METRICS_PORT:
+        return None
+    server = ThreadingHTTPServer(('127.0.0.1', int(METRICS_PORT)), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
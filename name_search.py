@@ -0,0 +1,187 @@
+import heapq
+import threading
+from collections import Counter
+
+# Порог похожести (коэффициент Жаккара по триграммам фамилии) для нечетких совпадений
+FUZZY_THRESHOLD = 0.3
+
+# Виды совпадений в порядке убывания приоритета
+EXACT, PREFIX, SUBSTRING, FUZZY = 'exact', 'prefix', 'substring', 'fuzzy'
+MATCH_RANK = {EXACT: 0, PREFIX: 1, SUBSTRING: 2, FUZZY: 3}
+
+# Кандидаты поиска - преподаватели, ключ - "фамилия инициалы" в нижнем регистре
+# (schedule_index.teacher_key). Однофамильцы с разными инициалами - разные кандидаты
+# Ключ -> строка для поиска (полное имя без званий, в нижнем регистре)
+search_texts = {}
+# Ключ -> полное имя в исходном написании (без званий)
+display_names = {}
+# Фамилия -> ключи преподавателей с этой фамилией
+surname_keys = {}
+# Триграмма -> множество ключей, в тексте которых она встречается (поиск подстроки)
+trigram_index = {}
+# Триграмма -> множество фамилий, в которых она встречается (нечеткий поиск:
+# инициалы в полном имени занижали бы похожесть)
+surname_trigram_index = {}
+# Число триграмм фамилии (для коэффициента Жаккара)
+trigram_counts = {}
+# Префиксное дерево фамилий: узел = {'children': {...}, 'surnames': set()}
+prefix_trie = {'children': {}, 'surnames': set()}
+
+index_lock = threading.Lock()
+
+def trigrams(text: str) -> set:
+    """Множество триграмм строки, дополненной пробелами по краям"""
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def split_key(key: str) -> tuple:
+    """Фамилия и инициалы из ключа преподавателя"""
+    surname, _, initials = key.partition(' ')
+    return surname, initials
+
+def normalize_initials(text: str) -> str:
+    """Инициалы без пробелов и точки в конце ("И. И." -> "и.и")"""
+    return ''.join(text.lower().split()).rstrip('.')
+
+def add_names(names):
+    """Добавляет в индекс пары (ключ преподавателя, полное имя преподавателя без званий)"""
+    with index_lock:
+        for key, full_name in names:
+            if key in search_texts:
+                continue
+            text = full_name.lower()
+            search_texts[key] = text
+            display_names[key] = full_name
+            for gram in trigrams(text):
+                trigram_index.setdefault(gram, set()).add(key)
+
+            surname = split_key(key)[0]
+            keys = surname_keys.setdefault(surname, set())
+            keys.add(key)
+            if len(keys) > 1:
+                continue
+            grams = trigrams(surname)
+            trigram_counts[surname] = len(grams)
+            for gram in grams:
+                surname_trigram_index.setdefault(gram, set()).add(surname)
+
+            node = prefix_trie
+            node['surnames'].add(surname)
+            for char in surname:
+                node = node['children'].setdefault(char, {'children': {}, 'surnames': set()})
+                node['surnames'].add(surname)
+
+def remove_names(keys):
+    """Удаляет преподавателей из индекса"""
+    with index_lock:
+        for key in keys:
+            text = search_texts.pop(key, None)
+            if text is None:
+                continue
+            del display_names[key]
+            discard_grams(trigram_index, trigrams(text), key)
+
+            # Фамилия остается в индексе, пока есть однофамильцы
+            surname = split_key(key)[0]
+            surname_keys[surname].discard(key)
+            if surname_keys[surname]:
+                continue
+            del surname_keys[surname]
+            del trigram_counts[surname]
+            discard_grams(surname_trigram_index, trigrams(surname), surname)
+
+            node = prefix_trie
+            node['surnames'].discard(surname)
+            for char in surname:
+                node = node['children'].get(char)
+                if node is None:
+                    break
+                node['surnames'].discard(surname)
+
+def discard_grams(index: dict, grams, value):
+    """Убирает значение из множеств триграмм индекса"""
+    for gram in grams:
+        holders = index.get(gram)
+        if holders is not None:
+            holders.discard(value)
+            if not holders:
+                del index[gram]
+
+def clear():
+    """Сбрасывает индекс"""
+    with index_lock:
+        search_texts.clear()
+        display_names.clear()
+        surname_keys.clear()
+        trigram_index.clear()
+        surname_trigram_index.clear()
+        trigram_counts.clear()
+        prefix_trie['children'].clear()
+        prefix_trie['surnames'].clear()
+
+def prefix_matches(prefix: str) -> set:
+    """Фамилии, начинающиеся с prefix"""
+    node = prefix_trie
+    for char in prefix:
+        node = node['children'].get(char)
+        if node is None:
+            return set()
+    return node['surnames']
+
+def substring_matches(query: str) -> set:
+    """Ключи преподавателей, полное имя которых содержит query"""
+    if len(query) < 3:
+        return set()
+    grams = [trigram_index.get(query[i:i + 3], set()) for i in range(len(query) - 2)]
+    candidates = set.intersection(*sorted(grams, key=len))
+    return {key for key in candidates if query in search_texts[key]}
+
+def fuzzy_matches(query: str) -> dict:
+    """Фамилии, похожие на фамилию из query (первое слово) по триграммам: фамилия -> коэффициент Жаккара"""
+    query_grams = trigrams(query.split()[0].strip(','))
+    shared = Counter()
+    for gram in query_grams:
+        shared.update(surname_trigram_index.get(gram, ()))
+    scores = {}
+    for surname, count in shared.items():
+        similarity = count / (len(query_grams) + trigram_counts[surname] - count)
+        if similarity >= FUZZY_THRESHOLD:
+            scores[surname] = similarity
+    return scores
+
+def search(query: str, limit: int = 5) -> list:
+    """Возвращает до limit кандидатов [(ключ преподавателя, вид совпадения)], отсортированных по релевантности.
+    Точное совпадение - фамилия и начало инициалов из запроса (без инициалов - все однофамильцы)"""
+    query = ' '.join(query.lower().split())
+    if not query:
+        return []
+
+    with index_lock:
+        ranked = {}
+        surname, _, initials = query.partition(' ')
+        initials = normalize_initials(initials)
+        for key in surname_keys.get(surname.strip(','), ()):
+            if split_key(key)[1].startswith(initials):
+                ranked[key] = (MATCH_RANK[EXACT], 0)
+        for surname in prefix_matches(query):
+            for key in surname_keys[surname]:
+                ranked.setdefault(key, (MATCH_RANK[PREFIX], len(surname)))
+        for key in substring_matches(query):
+            ranked.setdefault(key, (MATCH_RANK[SUBSTRING], len(key)))
+        if not ranked:
+            for surname, similarity in fuzzy_matches(query).items():
+                for key in surname_keys[surname]:
+                    ranked[key] = (MATCH_RANK[FUZZY], -similarity)
+
+    kinds = {rank: kind for kind, rank in MATCH_RANK.items()}
+    best = heapq.nsmallest(limit, ranked.items(), key=lambda item: (item[1], item[0]))
+    return [(key, kinds[rank[0]]) for key, rank in best]
+
+def keys_for_surname(surname: str) -> set:
+    """Ключи преподавателей с фамилией surname"""
+    with index_lock:
+        return set(surname_keys.get(surname, ()))
+
+def display_name(key: str) -> str:
+    """Полное имя преподавателя в исходном написании"""
+    return display_names.get(key, key)
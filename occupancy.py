@@ -0,0 +1,123 @@
+import os
+import re
+import threading
+from collections import Counter
+
+# Стандартные пары (значения столбца "Часы"): интервалы ЧЧ.ММ-ЧЧ.ММ через запятую
+CLASS_SLOTS = os.getenv("CLASS_SLOTS", "08.30-10.00,10.10-11.40,12.20-13.50,14.00-15.30,15.40-17.10,17.20-18.50,19.00-20.30")
+
+TIME_PATTERN = re.compile(r'(\d{1,2})[.:](\d{2})')
+# Значения столбца "Ауд.", которые не являются аудиторией
+NO_ROOM = {'', 'nan', 'none', '-'}
+
+def parse_minutes(text) -> list:
+    """Время в минутах от начала суток для всех значений ЧЧ.ММ (или ЧЧ:ММ) в строке"""
+    return [int(hours) * 60 + int(minutes) for hours, minutes in TIME_PATTERN.findall(str(text))]
+
+# Пары: [(начало, конец)] в минутах
+SLOTS = [tuple(parse_minutes(slot)[:2]) for slot in CLASS_SLOTS.split(',') if len(parse_minutes(slot)) >= 2]
+
+# Занятость аудиторий: порядковый номер даты -> {аудитория: битовая маска занятых пар}
+room_slots = {}
+# Известные аудитории -> число занятий в них
+room_counts = Counter()
+# Изменения идут из потоков загрузки и переноса в архив, чтение - из обработчиков команд
+occupancy_lock = threading.Lock()
+
+def normalize_room(audience):
+    """Название аудитории или None, если аудитория не указана"""
+    room = str(audience).strip() if audience is not None else ''
+    return None if room.lower() in NO_ROOM else room
+
+def slot_mask(time_str) -> int:
+    """Битовая маска стандартных пар, с которыми пересекается время занятия.
+    Номер пары ("3") тоже допускается"""
+    text = str(time_str).strip()
+    if text.isdigit():
+        number = int(text)
+        return 1 << (number - 1) if 1 <= number <= len(SLOTS) else 0
+    times = parse_minutes(text)
+    if not times:
+        return 0
+    start = times[0]
+    end = times[1] if len(times) > 1 and times[1] > start else start + 1
+    mask = 0
+    for i, (slot_start, slot_end) in enumerate(SLOTS):
+        if start < slot_end and end > slot_start:
+            mask |= 1 << i
+    return mask
+
+def slot_label(slot: int) -> str:
+    """Время пары по ее номеру (с 0)"""
+    start, end = SLOTS[slot]
+    return f"{start // 60:02d}.{start % 60:02d}-{end // 60:02d}.{end % 60:02d}"
+
+def add(ordinal: int, audience, time_str):
+    """Отмечает занятие в аудитории"""
+    room = normalize_room(audience)
+    if room is None:
+        return
+    mask = slot_mask(time_str)
+    with occupancy_lock:
+        room_counts[room] += 1
+        rooms = room_slots.setdefault(ordinal, {})
+        rooms[room] = rooms.get(room, 0) | mask
+
+def remove(ordinal: int, audience, count: int, remaining_times):
+    """Убирает count занятий из аудитории; маска дня пересчитывается по оставшимся занятиям"""
+    room = normalize_room(audience)
+    if room is None:
+        return
+    mask = 0
+    for time_str in remaining_times:
+        mask |= slot_mask(time_str)
+    with occupancy_lock:
+        room_counts[room] -= count
+        if room_counts[room] <= 0:
+            del room_counts[room]
+        rooms = room_slots.get(ordinal, {})
+        if mask:
+            rooms[room] = mask
+        else:
+            rooms.pop(room, None)
+            if not rooms:
+                room_slots.pop(ordinal, None)
+
+def clear():
+    """Сбрасывает данные о занятости"""
+    with occupancy_lock:
+        room_slots.clear()
+        room_counts.clear()
+
+def restore(slots, counts):
+    """Загружает данные о занятости (из снимка индекса)"""
+    with occupancy_lock:
+        room_slots.update(slots)
+        room_counts.update(counts)
+
+def room_sort_key(room: str):
+    """Естественный порядок: 101 < 205 < 1010 < Спортзал"""
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.split(r'(\d+)', room) if part]
+
+def free_rooms(day, slot: int) -> list:
+    """Аудитории, свободные в день day на паре slot (номер с 0)"""
+    bit = 1 << slot
+    with occupancy_lock:
+        rooms = room_slots.get(day.toordinal(), {})
+        free = [room for room in room_counts if not rooms.get(room, 0) & bit]
+    return sorted(free, key=room_sort_key)
+
+def find_room(name: str):
+    """Известная аудитория по названию (без учета регистра) или None"""
+    name = name.strip().lower()
+    with occupancy_lock:
+        for room in room_counts:
+            if room.lower() == name:
+                return room
+    return None
+
+def room_week(room: str, start) -> list:
+    """Маски занятых пар аудитории на 7 дней, начиная с start"""
+    ordinal = start.toordinal()
+    with occupancy_lock:
+        return [room_slots.get(ordinal + i, {}).get(room, 0) for i in range(7)]
@@ -0,0 +1,248 @@
+import logging
+import os
+import pickle
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from array import array
+from academic_calendar import current_academic_year, entry_date
+import name_search
+import occupancy
+import storage
+from schedule_table import ScheduleTable
+
+logger = logging.getLogger(__name__)
+
+# Снимок таблицы и индексов для быстрого запуска (рядом с основной базой)
+SNAPSHOT_PATH = os.path.join(os.path.dirname(storage.DB_PATH), 'index.snapshot')
+SNAPSHOT_VERSION = 2
+# Доля удаленных строк, после которой таблица перестраивается
+COMPACT_RATIO = 0.2
+
+# Звания, которые отбрасываются при нормализации имени преподавателя
+TEACHER_TITLES = ('доц.', 'ст.преп.', 'преп.', 'проф.', 'асс.')
+
+# Резидентная таблица записей (по столбцам)
+table = ScheduleTable()
+# Индекс: ключ преподавателя (teacher_key) -> (порядковые номера дат, номера строк таблицы),
+# оба массива отсортированы по дате
+teacher_index = {}
+# Счетчик перестроений таблицы: нечетный, пока таблица и индекс заменяются
+# (чтение без блокировки повторяется, если попало на замену)
+table_generation = 0
+# Записи с датами раньше archived_before перенесены в архивные шарды;
+# archive_first_dates - ключ преподавателя -> первая дата занятий в архиве
+archived_before = None
+archive_first_dates = {}
+
+def strip_titles(teacher: str) -> str:
+    """Убирает звания из начала строки преподавателя"""
+    parts = teacher.split()
+    while parts and parts[0].lower() in TEACHER_TITLES:
+        parts.pop(0)
+    return ' '.join(parts)
+
+def teacher_key(teacher: str) -> str:
+    """Ключ преподавателя: фамилия и инициалы без званий в нижнем регистре
+    ("доц. Иванов И. И." -> "иванов и.и"). Однофамильцы с разными инициалами различаются"""
+    parts = strip_titles(teacher).lower().split()
+    if not parts:
+        return ''
+    initials = name_search.normalize_initials(''.join(parts[1:]))
+    return parts[0].strip(',') + (' ' + initials if initials else '')
+
+def known_teacher(name: str):
+    """Ключ преподавателя из индекса по ключу или строке преподавателя. Строка только с фамилией
+    или неполными инициалами (старые подписки и кнопки) принимается, если подходит один
+    преподаватель. Иначе None"""
+    key = teacher_key(name)
+    if key in teacher_index:
+        return key
+    surname, initials = name_search.split_key(key)
+    keys = [known for known in name_search.keys_for_surname(surname) if name_search.split_key(known)[1].startswith(initials)]
+    return keys[0] if len(keys) == 1 else None
+
+def add_entries(entries):
+    """Добавляет записи в таблицу и индекс, сохраняя сортировку по дате"""
+    unsorted = set()
+    new_names = []
+    for entry in entries:
+        key = teacher_key(entry.get('teacher', ''))
+        day = entry_date(entry)
+        if not key or day is None:
+            continue
+        if key not in teacher_index:
+            new_names.append((key, strip_titles(entry['teacher'])))
+        ordinals, rows = teacher_index.setdefault(key, (array('i'), array('I')))
+        if ordinals and day.toordinal() < ordinals[-1]:
+            unsorted.add(key)
+        ordinals.append(day.toordinal())
+        rows.append(table.append(entry, day))
+        occupancy.add(day.toordinal(), entry.get('audience'), entry.get('time'))
+
+    for key in unsorted:
+        ordinals, rows = teacher_index[key]
+        order = sorted(range(len(ordinals)), key=ordinals.__getitem__)
+        teacher_index[key] = (array('i', (ordinals[i] for i in order)), array('I', (rows[i] for i in order)))
+
+    # Новых преподавателей добавляем в поисковый индекс
+    name_search.add_names(new_names)
+
+def remove_entries(entries):
+    """Удаляет записи из индекса (записи сравниваются по значениям полей)"""
+    removed = {}
+    for entry in entries:
+        key = teacher_key(entry.get('teacher', ''))
+        codes = table.entry_codes(entry)
+        if key in teacher_index and codes is not None:
+            removed.setdefault(key, set()).add(codes)
+
+    empty_names = []
+    # (дата, аудитория) -> число удаленных занятий
+    removed_cells = {}
+    for key, removed_codes in removed.items():
+        ordinals, rows = teacher_index[key]
+        keep = []
+        for i, row in enumerate(rows):
+            if table.row_codes(row) in removed_codes:
+                table.delete(row)
+                cell = (ordinals[i], table.row(row).get('audience'))
+                removed_cells[cell] = removed_cells.get(cell, 0) + 1
+            else:
+                keep.append(i)
+        if keep:
+            teacher_index[key] = (array('i', (ordinals[i] for i in keep)), array('I', (rows[i] for i in keep)))
+        else:
+            del teacher_index[key]
+            empty_names.append(key)
+
+    # Маски занятости пересчитываем по оставшимся занятиям этих дней
+    day_times = {}
+    for ordinal, audience in removed_cells:
+        if ordinal not in day_times:
+            times = day_times[ordinal] = {}
+            for row in table.select(date.fromordinal(ordinal), date.fromordinal(ordinal)):
+                times.setdefault(occupancy.normalize_room(table.row(row).get('audience')), []).append(table.row(row).get('time'))
+    for (ordinal, audience), count in removed_cells.items():
+        occupancy.remove(ordinal, audience, count, day_times[ordinal].get(occupancy.normalize_room(audience), []))
+
+    # Преподаватели без записей больше не предлагаются в поиске
+    name_search.remove_names(empty_names)
+
+def build_index(entries):
+    """Перестраивает индекс по всем записям расписания"""
+    clear_index()
+    add_entries(entries)
+
+def clear_index():
+    """Сбрасывает таблицу и индекс"""
+    global table
+    # Сначала очищаем индекс: номера строк из него не должны попасть в новую таблицу
+    teacher_index.clear()
+    table = ScheduleTable()
+    occupancy.clear()
+    name_search.clear()
+
+def needs_compaction() -> bool:
+    """Проверяет, накопилось ли в таблице достаточно удаленных строк для перестроения"""
+    return len(table.deleted) > COMPACT_RATIO * len(table.ordinals)
+
+def compact_table():
+    """Перестраивает таблицу и индекс без удаленных строк"""
+    global table, teacher_index, table_generation
+    if not table.deleted:
+        return
+    compacted, mapping = table.compacted()
+    index = {
+        key: (ordinals, array('I', (mapping[row] for row in rows)))
+        for key, (ordinals, rows) in teacher_index.items()
+    }
+    table_generation += 1
+    table, teacher_index = compacted, index
+    table_generation += 1
+
+def is_empty() -> bool:
+    """Проверяет, есть ли в индексе записи"""
+    return not teacher_index
+
+def set_archive_state(before, first_dates):
+    """Устанавливает границу архива и первые даты архивных занятий {строка преподавателя: дата}"""
+    global archived_before, archive_first_dates
+    key_dates = {}
+    for teacher, day in (first_dates or {}).items():
+        key = teacher_key(teacher)
+        if key not in key_dates or day < key_dates[key]:
+            key_dates[key] = day
+    archived_before, archive_first_dates = before, key_dates
+
+def date_bounds(teacher_name: str):
+    """Первая и последняя даты занятий преподавателя или None (с учетом архива)"""
+    key = teacher_key(teacher_name)
+    ordinals, _ = teacher_index.get(key, ((), ()))
+    first = date.fromordinal(ordinals[0]) if ordinals else None
+    last = date.fromordinal(ordinals[-1]) if ordinals else None
+    archived_first = archive_first_dates.get(key)
+    if archived_first is not None and (first is None or archived_first < first):
+        first = archived_first
+    return first, last
+
+def find_entries(teacher_name: str, start_date, end_date):
+    """Возвращает записи преподавателя с датами в диапазоне [start_date, end_date], отсортированные по дате:
+    представления строк таблицы, а для дат до границы архива - записи из архивных шардов"""
+    key = teacher_key(teacher_name)
+    while True:
+        generation = table_generation
+        current, index = table, teacher_index
+        ordinals, rows = index.get(key, ((), ()))
+        lo = bisect_left(ordinals, start_date.toordinal())
+        hi = bisect_right(ordinals, end_date.toordinal())
+        entries = [current.row(row) for row in rows[lo:hi]]
+        if generation % 2 == 0 and generation == table_generation:
+            break
+    if archived_before is not None and start_date < archived_before:
+        archived = storage.load_archived_entries(
+            start_date, min(end_date, archived_before - timedelta(days=1)),
+            lambda teacher: teacher_key(teacher) == key
+        )
+        entries = archived + entries
+    return entries
+
+def save_snapshot(data_version: str):
+    """Сохраняет таблицу и индексы на диск вместе с версией данных, по которым они построены"""
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'data_version': data_version,
+        # Даты записей без года зависят от текущего учебного года
+        'academic_year': current_academic_year(),
+        'table': table,
+        'teacher_index': teacher_index,
+        'names': list(name_search.display_names.items()),
+        'room_slots': occupancy.room_slots,
+        'room_counts': occupancy.room_counts,
+    }
+    os.makedirs(os.path.dirname(SNAPSHOT_PATH) or '.', exist_ok=True)
+    temp_path = SNAPSHOT_PATH + '.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, SNAPSHOT_PATH)
+
+def load_snapshot(data_version: str) -> bool:
+    """Загружает таблицу и индексы из снимка, если он построен по текущей версии данных"""
+    global table
+    if not os.path.exists(SNAPSHOT_PATH):
+        return False
+    try:
+        with open(SNAPSHOT_PATH, 'rb') as f:
+            snapshot = pickle.load(f)
+    except Exception as e:
+        logger.warning("Не удалось прочитать снимок индекса %s: %s", SNAPSHOT_PATH, e)
+        return False
+    if (snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('data_version') != data_version
+            or snapshot.get('academic_year') != current_academic_year()):
+        return False
+
+    clear_index()
+    table = snapshot['table']
+    teacher_index.update(snapshot['teacher_index'])
+    name_search.add_names(snapshot['names'])
+    occupancy.restore(snapshot['room_slots'], snapshot['room_counts'])
+    return True
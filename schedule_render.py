@@ -0,0 +1,159 @@
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from academic_calendar import entry_date
+import schedule_index
+import name_search
+import occupancy
+import metrics
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+MIN_WIDTH = 60  # Минимальная ширина для каждого поля
+
+# Максимальное число расписаний в кэше
+SCHEDULE_CACHE_SIZE = 512
+
+WEEKDAYS = ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')
+
+# LRU-кэш готовых сообщений: ('week', ключ преподавателя, понедельник) -> страница недели
+schedule_cache = OrderedDict()
+cache_stats = {"hits": 0, "misses": 0}
+# Поколение кэша: увеличивается при сбросе, чтобы не сохранять устаревший результат
+cache_generation = 0
+cache_lock = threading.Lock()
+
+def render_block(item) -> str:
+    """Формирует блок записи с рамкой"""
+    date_str = f"{item['date']}".ljust(MIN_WIDTH)
+    # Ограничиваем длину названия предмета и добавляем точку, если обрезается
+    subject = item['subject']
+    if len(subject) > MIN_WIDTH - 2:
+        subject = f"{subject[:MIN_WIDTH-5]}..."
+    subject_str = subject.ljust(MIN_WIDTH)
+    type_str = f"{item.get('type', '')}"[:MIN_WIDTH-5].ljust(MIN_WIDTH)
+    time_str = f"{item['time']}".ljust(MIN_WIDTH)
+    audience_str = f"Ауд. {item['audience']}".ljust(MIN_WIDTH)
+
+    return (
+        f"╔{'═' * (MIN_WIDTH + 2)}╗\n"
+        f"║ {date_str} ║\n"
+        f"║ {subject_str} ║\n"
+        f"║ {type_str} ║\n"
+        f"║ {time_str} ║\n"
+        f"║ {audience_str} ║\n"
+        f"╚{'═' * (MIN_WIDTH + 2)}╝\n\n"
+    )
+
+def unique_entries(entries) -> list:
+    """Удаляет дубликаты записей, сохраняя порядок"""
+    result = []
+    seen = set()
+    for entry in entries:
+        entry_tuple = (entry['date'], entry['teacher'], entry['subject'], entry['time'], entry['audience'], entry.get('type', ''))
+        if entry_tuple not in seen:
+            seen.add(entry_tuple)
+            result.append(entry)
+    return result
+
+def render_schedule(entries) -> list:
+    """Формирует сообщения с расписанием, разбитые по лимиту Telegram"""
+    schedule_messages = []
+    current_message = ""
+    for item in unique_entries(entries):
+        block = render_block(item)
+        # Проверяем, не превысит ли добавление новой записи лимит
+        if len(current_message) + len(block) > TELEGRAM_MESSAGE_LIMIT:
+            schedule_messages.append(current_message)
+            current_message = block
+        else:
+            current_message += block
+
+    # Добавляем последнее сообщение, если оно не пустое
+    if current_message:
+        schedule_messages.append(current_message)
+
+    return [f"```\n{msg}\n```" for msg in schedule_messages]
+
+def week_start(day):
+    """Понедельник недели, в которую входит дата"""
+    return day - timedelta(days=day.weekday())
+
+def render_week(teacher_name: str, start) -> str:
+    """Формирует страницу расписания преподавателя за неделю (одно сообщение)"""
+    end = start + timedelta(days=6)
+    lines = [f"{name_search.display_name(schedule_index.teacher_key(teacher_name))}: {start:%d.%m}–{end:%d.%m.%Y}"]
+    entries = unique_entries(schedule_index.find_entries(teacher_name, start, end))
+    current_day = None
+    for i, entry in enumerate(entries):
+        day = entry_date(entry)
+        line = f"  {entry['time']}  {entry['subject']}"
+        if entry.get('type'):
+            line += f" ({entry['type']})"
+        line += f", ауд. {entry['audience']}"
+        header = f"\n{WEEKDAYS[day.weekday()]} {day:%d.%m}" if day != current_day else ''
+        # Страница должна уместиться в одно сообщение вместе с рамкой блока кода
+        if sum(len(l) + 1 for l in lines) + len(header) + len(line) + 40 > TELEGRAM_MESSAGE_LIMIT:
+            lines.append(f"… и еще занятий: {len(entries) - i}")
+            break
+        if header:
+            lines.append(header)
+            current_day = day
+        lines.append(line)
+    if not entries:
+        lines.append("\nЗанятий нет")
+    text = '\n'.join(lines)
+    return f"```\n{text}\n```"
+
+def render_room_week(room: str, start) -> str:
+    """Формирует таблицу занятости аудитории по парам за неделю, начинающуюся с start"""
+    end = start + timedelta(days=6)
+    slots = range(len(occupancy.SLOTS))
+    lines = [f"Ауд. {room}: {start:%d.%m}–{end:%d.%m.%Y}", "",
+             "пара      " + ' '.join(str(slot + 1) for slot in slots)]
+    for i, mask in enumerate(occupancy.room_week(room, start)):
+        day = start + timedelta(days=i)
+        cells = ' '.join('■' if mask & (1 << slot) else '·' for slot in slots)
+        lines.append(f"{WEEKDAYS[i]} {day:%d.%m}  {cells}")
+    lines.append("")
+    lines.extend(f"{slot + 1}) {occupancy.slot_label(slot)}" for slot in slots)
+    text = '\n'.join(lines)
+    return f"```\n{text}\n```"
+
+def get_cached(key, build):
+    """Возвращает значение из LRU-кэша или формирует его функцией build"""
+    with cache_lock:
+        if key in schedule_cache:
+            schedule_cache.move_to_end(key)
+            cache_stats["hits"] += 1
+            metrics.inc('schedule_cache_total', result='hit')
+            return schedule_cache[key]
+        cache_stats["misses"] += 1
+        metrics.inc('schedule_cache_total', result='miss')
+        generation = cache_generation
+
+    with metrics.stage('render_schedule'):
+        value = build()
+
+    with cache_lock:
+        if generation == cache_generation:
+            schedule_cache[key] = value
+            if len(schedule_cache) > SCHEDULE_CACHE_SIZE:
+                schedule_cache.popitem(last=False)
+    return value
+
+def get_week_page(teacher_name: str, start) -> str:
+    """Возвращает страницу недели, начинающейся с понедельника start; страница формируется при первом запросе"""
+    key = ('week', schedule_index.teacher_key(teacher_name), start)
+    return get_cached(key, lambda: render_week(teacher_name, start))
+
+def invalidate_cache():
+    """Сбрасывает кэш после изменения данных расписания"""
+    global cache_generation
+    with cache_lock:
+        cache_generation += 1
+        schedule_cache.clear()
+
+def get_cache_stats() -> dict:
+    """Возвращает счетчики попаданий и промахов кэша"""
+    with cache_lock:
+        return dict(cache_stats, size=len(schedule_cache))
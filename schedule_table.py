@@ -0,0 +1,131 @@
+from array import array
+from collections.abc import Mapping
+from datetime import date
+
+# Поля записи, хранимые в таблице (как в storage.ENTRY_FIELDS)
+FIELDS = ('sheet', 'date', 'subject', 'teacher', 'time', 'audience', 'type', 'full_date')
+
+# Код отсутствующего значения (поле не задано в записи)
+MISSING = 0
+
+class StringPool:
+    """Словарь строк столбца: каждое значение хранится один раз, в столбце - его код"""
+    __slots__ = ('values', 'codes')
+
+    def __init__(self):
+        self.values = [None]
+        self.codes = {None: MISSING}
+
+    def code(self, value) -> int:
+        """Код значения; новое значение добавляется в словарь"""
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def find(self, value):
+        """Код значения или None, если значения нет в словаре"""
+        return self.codes.get(value)
+
+class Row(Mapping):
+    """Легкое представление строки таблицы с интерфейсом словаря записи"""
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index: int):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, field):
+        column = self.table.columns.get(field)
+        if column is None:
+            raise KeyError(field)
+        code = column[self.index]
+        if code == MISSING:
+            raise KeyError(field)
+        return self.table.pools[field].values[code]
+
+    def __iter__(self):
+        return (field for field in FIELDS if self.table.columns[field][self.index] != MISSING)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    @property
+    def day(self) -> date:
+        """Дата занятия"""
+        return date.fromordinal(self.table.ordinals[self.index])
+
+class ScheduleTable:
+    """Таблица записей расписания по столбцам: строковые поля хранятся кодами словарей
+    в массивах, даты - порядковыми номерами"""
+
+    def __init__(self):
+        self.pools = {field: StringPool() for field in FIELDS}
+        self.columns = {field: array('I') for field in FIELDS}
+        self.ordinals = array('i')
+        # Удаленные строки остаются в массивах до перестроения таблицы
+        self.deleted = set()
+
+    def __len__(self):
+        return len(self.ordinals) - len(self.deleted)
+
+    def append(self, entry, day: date) -> int:
+        """Добавляет запись с датой занятия day. Возвращает номер строки"""
+        for field in FIELDS:
+            self.columns[field].append(self.pools[field].code(entry.get(field)))
+        self.ordinals.append(day.toordinal())
+        return len(self.ordinals) - 1
+
+    def row(self, index: int) -> Row:
+        return Row(self, index)
+
+    def row_codes(self, index: int) -> tuple:
+        """Коды значений строки"""
+        return tuple(self.columns[field][index] for field in FIELDS)
+
+    def entry_codes(self, entry):
+        """Коды значений записи или None, если какого-то значения нет в таблице"""
+        codes = []
+        for field in FIELDS:
+            code = self.pools[field].find(entry.get(field))
+            if code is None:
+                return None
+            codes.append(code)
+        return tuple(codes)
+
+    def delete(self, index: int):
+        self.deleted.add(index)
+
+    def compacted(self):
+        """Новая таблица только из неудаленных строк (словари тоже перестраиваются).
+        Возвращает (таблица, массив новых номеров строк; -1 для удаленных)"""
+        live = [index for index in range(len(self.ordinals)) if index not in self.deleted]
+        table = ScheduleTable()
+        for field in FIELDS:
+            values = self.pools[field].values
+            pool = table.pools[field]
+            column = self.columns[field]
+            table.columns[field] = array('I', (pool.code(values[column[index]]) for index in live))
+        table.ordinals = array('i', (self.ordinals[index] for index in live))
+        mapping = array('i', [-1]) * len(self.ordinals)
+        for new_index, index in enumerate(live):
+            mapping[index] = new_index
+        return table, mapping
+
+    def select(self, start_date=None, end_date=None, **values) -> list:
+        """Номера строк с датами в диапазоне [start_date, end_date] и заданными значениями полей
+        (например, teacher=...). Фильтрация выполняется над столбцами целиком"""
+        import numpy as np
+        mask = np.ones(len(self.ordinals), dtype=bool)
+        ordinals = np.frombuffer(self.ordinals, dtype=np.int32)
+        if start_date is not None:
+            mask &= ordinals >= start_date.toordinal()
+        if end_date is not None:
+            mask &= ordinals <= end_date.toordinal()
+        for field, value in values.items():
+            code = self.pools[field].find(value)
+            if code is None:
+                return []
+            mask &= np.frombuffer(self.columns[field], dtype=np.uint32) == code
+        return [index for index in np.flatnonzero(mask).tolist() if index not in self.deleted]
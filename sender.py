@@ -0,0 +1,248 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from telebot.apihelper import ApiTelegramException
+from bot import bot
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Общий лимит Telegram: не более ~30 сообщений в секунду
+GLOBAL_RATE = float(os.getenv("SENDER_GLOBAL_RATE", "25"))
+GLOBAL_BURST = 25
+# Лимит на один чат: не чаще одного сообщения в секунду после короткой серии
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+# Число потоков отправки
+SENDER_THREADS = int(os.getenv("SENDER_THREADS", "4"))
+# Повторные попытки при сетевых ошибках
+MAX_ATTEMPTS = 5
+
+# Очереди исходящих сообщений: chat_id -> deque
+chat_queues = {}
+# Чаты, в очереди которых есть сообщения, в порядке поступления
+ready_chats = deque()
+# Чаты, сообщение которых сейчас отправляется
+busy_chats = set()
+# Корзины токенов чатов: chat_id -> [токены, время обновления]
+chat_buckets = {}
+global_bucket = [GLOBAL_BURST, time.monotonic()]
+# Время, до которого приостановлена вся отправка: 429 может относиться к общему лимиту бота
+global_paused_until = 0.0
+# Время, до которого отправка в чат приостановлена (Retry-After и повторы): chat_id -> время
+paused_until = {}
+# Корзины и паузы чатов без очереди удаляются, когда корзина снова полна и пауза истекла;
+# проверка выполняется не чаще, чем раз в это время
+EVICT_INTERVAL = CHAT_BURST / CHAT_RATE
+last_eviction = time.monotonic()
+
+condition = threading.Condition()
+workers = []
+
+def take_token(bucket, rate, burst, now) -> float:
+    """Забирает токен из корзины. Возвращает 0 или время ожидания до появления токена"""
+    tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+    bucket[1] = now
+    if tokens >= 1:
+        bucket[0] = tokens - 1
+        return 0.0
+    bucket[0] = tokens
+    return (1 - tokens) / rate
+
+def escape_markdown(text: str) -> str:
+    """Экранирует спецсимволы Markdown (legacy) в простом тексте"""
+    for char in ('\\', '_', '*', '`', '['):
+        text = text.replace(char, '\\' + char)
+    return text
+
+def markup_key(kwargs):
+    """Ключ для сравнения клавиатур сообщений"""
+    markup = kwargs.get('reply_markup')
+    return markup.to_json() if markup is not None else None
+
+def try_coalesce(first, second):
+    """Объединяет два соседних сообщения одного чата, если это возможно"""
+    if 'message_id' in first or 'message_id' in second:
+        return None
+    first_kwargs, second_kwargs = first['kwargs'], second['kwargs']
+    if set(first_kwargs) - {'parse_mode', 'reply_markup'} or set(second_kwargs) - {'parse_mode', 'reply_markup'}:
+        return None
+    if markup_key(first_kwargs) != markup_key(second_kwargs):
+        return None
+
+    first_text, second_text = first['text'], second['text']
+    first_mode, second_mode = first_kwargs.get('parse_mode'), second_kwargs.get('parse_mode')
+    if first_mode != second_mode:
+        if {first_mode, second_mode} != {'Markdown', None}:
+            return None
+        if first_mode is None:
+            first_text = escape_markdown(first_text)
+        else:
+            second_text = escape_markdown(second_text)
+
+    text = f"{first_text}\n{second_text}"
+    if len(text) > TELEGRAM_MESSAGE_LIMIT:
+        return None
+    kwargs = dict(first_kwargs, **second_kwargs)
+    if first_mode or second_mode:
+        kwargs['parse_mode'] = first_mode or second_mode
+    return {'text': text, 'kwargs': kwargs, 'attempt': 0}
+
+def enqueue(chat_id, text, **kwargs):
+    """Ставит сообщение в очередь чата и сразу возвращает управление"""
+    ensure_workers()
+    with condition:
+        queue = chat_queues.setdefault(chat_id, deque())
+        if not queue and chat_id not in busy_chats:
+            ready_chats.append(chat_id)
+        queue.append({'text': text, 'kwargs': kwargs, 'attempt': 0})
+        condition.notify()
+
+def edit_message_text(chat_id, message_id, text, **kwargs):
+    """Асинхронный аналог bot.edit_message_text"""
+    ensure_workers()
+    item = {'text': text, 'kwargs': kwargs, 'attempt': 0, 'message_id': message_id}
+    with condition:
+        queue = chat_queues.setdefault(chat_id, deque())
+        # Неотправленное изменение того же сообщения заменяем новым
+        for i, pending in enumerate(queue):
+            if pending.get('message_id') == message_id:
+                queue[i] = item
+                return
+        if not queue and chat_id not in busy_chats:
+            ready_chats.append(chat_id)
+        queue.append(item)
+        condition.notify()
+
+def send_message(chat_id, text, **kwargs):
+    """Асинхронный аналог bot.send_message"""
+    enqueue(chat_id, text, **kwargs)
+
+def reply_to(message, text, **kwargs):
+    """Асинхронный аналог bot.reply_to"""
+    enqueue(message.chat.id, text, reply_to_message_id=message.message_id, **kwargs)
+
+def next_item():
+    """Выбирает чат, в который можно отправлять, и извлекает из его очереди сообщение"""
+    with condition:
+        while True:
+            now = time.monotonic()
+            wait = None
+            for _ in range(len(ready_chats)):
+                chat_id = ready_chats.popleft()
+                chat_wait = max(paused_until.get(chat_id, 0.0) - now, 0.0)
+                if not chat_wait:
+                    bucket = chat_buckets.setdefault(chat_id, [CHAT_BURST, now])
+                    chat_wait = take_token(bucket, CHAT_RATE, CHAT_BURST, now)
+                if chat_wait:
+                    ready_chats.append(chat_id)
+                    wait = chat_wait if wait is None else min(wait, chat_wait)
+                    continue
+
+                queue = chat_queues[chat_id]
+                item = queue.popleft()
+                # Соседние короткие сообщения отправляем одним
+                while queue:
+                    merged = try_coalesce(item, queue[0])
+                    if merged is None:
+                        break
+                    queue.popleft()
+                    item = merged
+                busy_chats.add(chat_id)
+                return chat_id, item
+            condition.wait(timeout=wait)
+
+def finish_item(chat_id, item=None):
+    """Завершает отправку; item возвращается в начало очереди для повтора"""
+    with condition:
+        busy_chats.discard(chat_id)
+        queue = chat_queues.get(chat_id)
+        if item is not None:
+            queue.appendleft(item)
+        if queue:
+            ready_chats.append(chat_id)
+        else:
+            # Корзину не удаляем: иначе следующее сообщение снова получило бы полную серию
+            chat_queues.pop(chat_id, None)
+            evict_idle_chats(time.monotonic())
+        condition.notify_all()
+
+def evict_idle_chats(now):
+    """Удаляет корзины и паузы чатов без очереди, которые уже ни на что не влияют
+    (вызывается под condition)"""
+    global last_eviction
+    if now - last_eviction < EVICT_INTERVAL:
+        return
+    last_eviction = now
+    for chat_id, bucket in list(chat_buckets.items()):
+        if chat_id not in chat_queues and bucket[0] + (now - bucket[1]) * CHAT_RATE >= CHAT_BURST:
+            del chat_buckets[chat_id]
+    for chat_id, until in list(paused_until.items()):
+        if until <= now:
+            del paused_until[chat_id]
+
+def deliver(chat_id, item):
+    """Отправляет сообщение с учетом общего лимита и Retry-After"""
+    global global_paused_until
+    while True:
+        with condition:
+            now = time.monotonic()
+            wait = global_paused_until - now
+            if wait <= 0:
+                wait = take_token(global_bucket, GLOBAL_RATE, GLOBAL_BURST, now)
+        if not wait:
+            break
+        time.sleep(wait)
+
+    try:
+        with metrics.stage('send_message'):
+            if 'message_id' in item:
+                bot.edit_message_text(item['text'], chat_id, item['message_id'], **item['kwargs'])
+            else:
+                bot.send_message(chat_id, item['text'], **item['kwargs'])
+        metrics.inc('messages_sent_total')
+        finish_item(chat_id)
+    except ApiTelegramException as e:
+        metrics.inc('send_errors_total', reason=str(e.error_code))
+        if e.error_code == 429:
+            retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+            with condition:
+                until = time.monotonic() + retry_after
+                paused_until[chat_id] = until
+                # Остальные потоки тоже ждут, чтобы не получать новые 429 и не продлевать блокировку
+                global_paused_until = max(global_paused_until, until)
+            finish_item(chat_id, item)
+        else:
+            logger.error("Не удалось отправить сообщение в чат %s: %s", chat_id, e)
+            finish_item(chat_id)
+    except Exception as e:
+        metrics.inc('send_errors_total', reason='network')
+        item['attempt'] += 1
+        if item['attempt'] >= MAX_ATTEMPTS:
+            logger.error("Сообщение в чат %s не отправлено после %s попыток: %s", chat_id, MAX_ATTEMPTS, e)
+            finish_item(chat_id)
+            return
+        # Экспоненциальная задержка при сетевых ошибках
+        with condition:
+            paused_until[chat_id] = time.monotonic() + 2 ** item['attempt']
+        finish_item(chat_id, item)
+
+def worker_loop():
+    """Цикл потока отправки"""
+    while True:
+        chat_id, item = next_item()
+        deliver(chat_id, item)
+
+def ensure_workers():
+    """Запускает потоки отправки при первом обращении"""
+    with condition:
+        if workers:
+            return
+        for i in range(SENDER_THREADS):
+            worker = threading.Thread(target=worker_loop, name=f'sender-{i}', daemon=True)
+            worker.start()
+            workers.append(worker)
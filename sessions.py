@@ -0,0 +1,191 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from enum import IntEnum
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = 'data/sessions.json'
+SNAPSHOT_VERSION = 1
+
+# Сессии чатов, неактивных дольше этого срока, удаляются
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_DAYS", "30")) * 24 * 3600
+# Предельное число хранимых сессий: при превышении удаляются самые давние
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "50000"))
+# Период сохранения снимка на диск
+SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("SESSION_SNAPSHOT_SECONDS", "60"))
+
+TEACHER = "Teacher"
+ADMIN = "Admin"
+ROLES = (TEACHER, ADMIN)
+
+class PendingState(IntEnum):
+    """Ожидаемый от чата ввод"""
+    NONE = 0
+    TEACHER_NAME = 1
+    ADMIN_PASSWORD = 2
+    NEW_PASSWORD = 3
+    SUBSCRIBE_NAME = 4
+
+class Session:
+    """Состояние одного чата"""
+    __slots__ = ('role', 'state', 'last_seen')
+
+    def __init__(self, role=TEACHER, state=PendingState.NONE, last_seen=0.0):
+        self.role = role
+        self.state = state
+        self.last_seen = last_seen
+
+    def is_default(self) -> bool:
+        return self.role == TEACHER and self.state == PendingState.NONE
+
+# Сессии в порядке последнего обращения: chat_id -> Session.
+# Чаты с ролью Teacher без ожидаемого ввода не хранятся
+sessions = OrderedDict()
+sessions_lock = threading.RLock()
+loaded = False
+dirty = False
+snapshot_thread = None
+
+def load_snapshot():
+    """Загружает сессии из снимка на диске"""
+    if not os.path.exists(SNAPSHOT_PATH):
+        return
+    try:
+        with open(SNAPSHOT_PATH, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Не удалось прочитать снимок сессий %s: %s", SNAPSHOT_PATH, e)
+        return
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        return
+
+    expire_before = time.time() - SESSION_TTL_SECONDS
+    # Записи сохранены в порядке последнего обращения
+    for chat_id, role_code, state, last_seen in snapshot.get('sessions', []):
+        if last_seen >= expire_before:
+            sessions[chat_id] = Session(ROLES[role_code], PendingState(state), last_seen)
+
+def save_snapshot():
+    """Сохраняет сессии на диск, если они изменились"""
+    global dirty
+    with sessions_lock:
+        if not dirty:
+            return
+        rows = [[chat_id, ROLES.index(session.role), int(session.state), session.last_seen]
+                for chat_id, session in sessions.items()]
+        dirty = False
+
+    os.makedirs(os.path.dirname(SNAPSHOT_PATH) or '.', exist_ok=True)
+    temp_path = SNAPSHOT_PATH + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': SNAPSHOT_VERSION, 'sessions': rows}, f, separators=(',', ':'))
+    os.replace(temp_path, SNAPSHOT_PATH)
+
+def evict_expired(now=None):
+    """Удаляет сессии неактивных чатов и лишние сессии сверх MAX_SESSIONS"""
+    global dirty
+    now = now or time.time()
+    expire_before = now - SESSION_TTL_SECONDS
+    with sessions_lock:
+        while sessions:
+            chat_id, session = next(iter(sessions.items()))
+            if session.last_seen >= expire_before and len(sessions) <= MAX_SESSIONS:
+                break
+            del sessions[chat_id]
+            dirty = True
+
+def snapshot_loop():
+    """Периодически удаляет устаревшие сессии и сохраняет снимок"""
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL_SECONDS)
+        try:
+            evict_expired()
+            save_snapshot()
+        except Exception as e:
+            logger.warning("Не удалось сохранить снимок сессий: %s", e)
+
+def ensure_loaded():
+    """Загружает снимок и запускает фоновое сохранение при первом обращении"""
+    global loaded, snapshot_thread
+    if loaded:
+        return
+    with sessions_lock:
+        if loaded:
+            return
+        load_snapshot()
+        snapshot_thread = threading.Thread(target=snapshot_loop, name='sessions-snapshot', daemon=True)
+        snapshot_thread.start()
+        atexit.register(save_snapshot)
+        loaded = True
+
+def touch(chat_id) -> Session:
+    """Возвращает сессию чата, отмечая обращение (без создания записи)"""
+    session = sessions.get(chat_id)
+    if session is None:
+        return Session()
+    session.last_seen = time.time()
+    sessions.move_to_end(chat_id)
+    return session
+
+def store(chat_id, session: Session):
+    """Сохраняет измененную сессию; сессии по умолчанию удаляются"""
+    global dirty
+    dirty = True
+    if session.is_default():
+        sessions.pop(chat_id, None)
+        return
+    session.last_seen = time.time()
+    sessions[chat_id] = session
+    sessions.move_to_end(chat_id)
+    if len(sessions) > MAX_SESSIONS:
+        sessions.popitem(last=False)
+
+def get_role(chat_id) -> str:
+    """Роль пользователя чата"""
+    ensure_loaded()
+    with sessions_lock:
+        return touch(chat_id).role
+
+def set_role(chat_id, role: str):
+    """Устанавливает роль пользователя чата"""
+    ensure_loaded()
+    with sessions_lock:
+        session = touch(chat_id)
+        session.role = role
+        store(chat_id, session)
+
+def get_state(chat_id) -> PendingState:
+    """Ожидаемый от чата ввод"""
+    ensure_loaded()
+    with sessions_lock:
+        return touch(chat_id).state
+
+def set_state(chat_id, state: PendingState):
+    """Устанавливает ожидаемый от чата ввод"""
+    ensure_loaded()
+    with sessions_lock:
+        session = touch(chat_id)
+        session.state = state
+        store(chat_id, session)
+
+def take_state(chat_id) -> PendingState:
+    """Возвращает ожидаемый ввод и сбрасывает его (атомарно)"""
+    ensure_loaded()
+    with sessions_lock:
+        session = touch(chat_id)
+        state = session.state
+        if state != PendingState.NONE:
+            session.state = PendingState.NONE
+            store(chat_id, session)
+        return state
+
+def reset(chat_id):
+    """Сбрасывает состояние одного чата"""
+    ensure_loaded()
+    with sessions_lock:
+        store(chat_id, Session())
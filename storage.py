@@ -0,0 +1,499 @@
+import json
+import os
+import sqlite3
+import uuid
+from datetime import date
+from academic_calendar import resolve_date, term_bounds, term_of
+
+# Путь к базе задается через окружение, чтобы его видели и рабочие процессы разбора файлов
+DB_PATH = os.getenv("SCHEDULE_DB_PATH", "data/schedule.db")
+LEGACY_JSON_PATH = 'data/schedule.json'
+# Архивные шарды: по одной базе на семестр (<ГГГГ-N>.db) рядом с основной базой
+ARCHIVE_DIR = os.path.join(os.path.dirname(DB_PATH), 'archive')
+
+# Поля записи расписания в порядке столбцов таблицы entries
+ENTRY_FIELDS = ('sheet', 'date', 'subject', 'teacher', 'time', 'audience', 'type', 'full_date')
+
+ENTRIES_TABLE = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    sheet TEXT,
+    date TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    teacher TEXT NOT NULL,
+    time TEXT,
+    audience TEXT,
+    type TEXT,
+    full_date TEXT,
+    source_file TEXT
+);
+"""
+
+# Ключ дубликатов: полная дата (или DD.MM, если год неизвестен), предмет и преподаватель.
+# Создается после добавления столбца full_date в старые базы
+ENTRY_KEY_INDEX = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_entries_key ON entries (COALESCE(full_date, date), subject, teacher)
+"""
+# Ограничение прежней схемы: не учитывало год, и занятие в тот же день следующего года отбрасывалось
+LEGACY_ENTRY_KEY = 'UNIQUE (date, subject, teacher)'
+
+SCHEMA = ENTRIES_TABLE + """
+CREATE INDEX IF NOT EXISTS idx_entries_teacher ON entries (teacher);
+CREATE INDEX IF NOT EXISTS idx_entries_date ON entries (date);
+CREATE INDEX IF NOT EXISTS idx_entries_sheet ON entries (sheet);
+CREATE TABLE IF NOT EXISTS processed_files (
+    name TEXT PRIMARY KEY,
+    content_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS file_sheets (
+    file_name TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    sheet_hash TEXT NOT NULL,
+    PRIMARY KEY (file_name, sheet)
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    chat_id INTEGER PRIMARY KEY,
+    -- ключ преподавателя (фамилия и инициалы); в старых подписках только фамилия
+    surname TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS archive_first_dates (
+    teacher TEXT PRIMARY KEY,
+    first_date TEXT NOT NULL
+);
+"""
+
+ARCHIVE_SCHEMA = ENTRIES_TABLE + """
+CREATE INDEX IF NOT EXISTS idx_entries_full_date ON entries (full_date);
+"""
+
+# Базы, для которых уже создана схема и выполнена миграция
+_initialized = set()
+
+def connect():
+    """Открывает соединение с базой, при первом обращении создает схему и переносит данные из JSON"""
+    os.makedirs(os.path.dirname(DB_PATH) or '.', exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    if DB_PATH not in _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '1')")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', ?)", (uuid.uuid4().hex,))
+        upgrade_schema(conn)
+        migrate_archive_first_dates(conn)
+        migrate_legacy_json(conn)
+        resolve_missing_dates(conn)
+        _initialized.add(DB_PATH)
+    return conn
+
+def upgrade_schema(conn):
+    """Добавляет в базы, созданные ранее, столбцы full_date, source_file, content_hash и индексы по ним"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+    file_columns = {row[1] for row in conn.execute("PRAGMA table_info(processed_files)")}
+    with conn:
+        if 'full_date' not in columns:
+            conn.execute("ALTER TABLE entries ADD COLUMN full_date TEXT")
+        if 'source_file' not in columns:
+            conn.execute("ALTER TABLE entries ADD COLUMN source_file TEXT")
+        if 'content_hash' not in file_columns:
+            conn.execute("ALTER TABLE processed_files ADD COLUMN content_hash TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_full_date ON entries (full_date)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_source ON entries (source_file, sheet)")
+    upgrade_entry_key(conn)
+
+def upgrade_entry_key(conn):
+    """Заменяет ограничение UNIQUE (date, subject, teacher) уникальным индексом с полной датой.
+    Ограничение таблицы нельзя удалить, поэтому таблица entries пересоздается"""
+    table_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'entries'").fetchone()[0]
+    if LEGACY_ENTRY_KEY in table_sql:
+        index_sqls = [sql for (sql,) in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'entries' AND sql IS NOT NULL"
+        )]
+        columns = ', '.join(('id',) + ENTRY_FIELDS + ('source_file',))
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute("ALTER TABLE entries RENAME TO entries_old")
+            conn.execute(ENTRIES_TABLE)
+            conn.execute(f"INSERT INTO entries ({columns}) SELECT {columns} FROM entries_old")
+            conn.execute("DROP TABLE entries_old")
+            for sql in index_sqls:
+                conn.execute(sql)
+    with conn:
+        conn.execute(ENTRY_KEY_INDEX)
+
+def resolve_missing_dates(conn):
+    """Заполняет full_date у записей без года датой, ближайшей к сегодняшнему дню"""
+    updates = []
+    for entry_id, date_str in conn.execute("SELECT id, date FROM entries WHERE full_date IS NULL"):
+        resolved = resolve_date(date_str)
+        if resolved:
+            updates.append((resolved.isoformat(), entry_id))
+    if not updates:
+        return
+    with conn:
+        # Запись, совпавшая по ключу с уже датированной, заменяет ее
+        conn.executemany("UPDATE OR REPLACE entries SET full_date = ? WHERE id = ?", updates)
+        bump_data_version(conn)
+
+def migrate_legacy_json(conn):
+    """Однократно переносит данные из schedule.json (включая старый формат-список) в базу"""
+    if not os.path.exists(LEGACY_JSON_PATH):
+        return
+    with open(LEGACY_JSON_PATH, 'r', encoding='utf-8') as f:
+        legacy = json.load(f)
+    if isinstance(legacy, list):
+        legacy = {"meta": {"processed_files": []}, "schedule_data": legacy}
+    with conn:
+        insert_data(conn, legacy)
+    # Переименовываем исходный файл, чтобы миграция не повторялась
+    os.replace(LEGACY_JSON_PATH, LEGACY_JSON_PATH + '.migrated')
+
+def entry_to_row(entry):
+    """Преобразует запись в кортеж значений столбцов"""
+    return tuple(entry.get(field) for field in ENTRY_FIELDS)
+
+def row_to_entry(row):
+    """Преобразует строку таблицы в запись расписания"""
+    entry = dict(zip(ENTRY_FIELDS, row))
+    for optional_field in ('type', 'full_date'):
+        if entry[optional_field] is None:
+            del entry[optional_field]
+    return entry
+
+def bump_data_version(conn):
+    """Отмечает изменение записей расписания новой версией данных (без фиксации транзакции)"""
+    conn.execute("UPDATE meta SET value = ? WHERE key = 'data_version'", (uuid.uuid4().hex,))
+
+def load_data_version() -> str:
+    """Версия данных: меняется при каждом изменении записей, по ней проверяется снимок индекса"""
+    conn = connect()
+    try:
+        return conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()[0]
+    finally:
+        conn.close()
+
+def insert_data(conn, data):
+    """Добавляет записи и обработанные файлы (без фиксации транзакции)"""
+    bump_data_version(conn)
+    conn.executemany(
+        f"INSERT OR IGNORE INTO entries ({', '.join(ENTRY_FIELDS)}) VALUES ({', '.join('?' * len(ENTRY_FIELDS))})",
+        (entry_to_row(entry) for entry in data.get("schedule_data", []))
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO processed_files (name) VALUES (?)",
+        ((name,) for name in data.get("meta", {}).get("processed_files", []))
+    )
+
+def load_data():
+    """Загружает все данные в формате {"meta": ..., "schedule_data": [...]}"""
+    conn = connect()
+    try:
+        version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+        processed_files = [row[0] for row in conn.execute("SELECT name FROM processed_files ORDER BY rowid")]
+        rows = conn.execute(f"SELECT {', '.join(ENTRY_FIELDS)} FROM entries ORDER BY id")
+        return {
+            "meta": {
+                "processed_files": processed_files,
+                "version": int(version)
+            },
+            "schedule_data": [row_to_entry(row) for row in rows]
+        }
+    finally:
+        conn.close()
+
+def load_entry_keys() -> set:
+    """Загружает ключи (полная дата или DD.MM, subject, teacher) всех сохраненных записей"""
+    conn = connect()
+    try:
+        return set(conn.execute("SELECT COALESCE(full_date, date), subject, teacher FROM entries"))
+    finally:
+        conn.close()
+
+def load_file_state(file_name: str) -> tuple:
+    """Хэш сохраненной версии файла и хэши ее листов: (хэш или None, {лист: хэш})"""
+    conn = connect()
+    try:
+        row = conn.execute("SELECT content_hash FROM processed_files WHERE name = ?", (file_name,)).fetchone()
+        sheets = dict(conn.execute("SELECT sheet, sheet_hash FROM file_sheets WHERE file_name = ?", (file_name,)))
+        return (row[0] if row else None), sheets
+    finally:
+        conn.close()
+
+def load_source_entries(file_name: str, sheets) -> list:
+    """Записи, добавленные из указанных листов файла: [(id, запись)]"""
+    conn = connect()
+    try:
+        result = []
+        for sheet in sheets:
+            rows = conn.execute(
+                f"SELECT id, {', '.join(ENTRY_FIELDS)} FROM entries WHERE source_file = ? AND sheet = ?",
+                (file_name, sheet)
+            )
+            result.extend((row[0], row_to_entry(row[1:])) for row in rows)
+        return result
+    finally:
+        conn.close()
+
+def apply_revisions(revisions):
+    """Применяет изменения файлов одной транзакцией. Каждое изменение - словарь с ключами
+    file_name, file_hash, sheet_hashes, removed_ids, new_entries"""
+    conn = connect()
+    try:
+        with conn:
+            bump_data_version(conn)
+            for revision in revisions:
+                conn.executemany("DELETE FROM entries WHERE id = ?", ((entry_id,) for entry_id in revision["removed_ids"]))
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO entries ({', '.join(ENTRY_FIELDS)}, source_file) "
+                    f"VALUES ({', '.join('?' * (len(ENTRY_FIELDS) + 1))})",
+                    (entry_to_row(entry) + (revision["file_name"],) for entry in revision["new_entries"])
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO processed_files (name, content_hash) VALUES (?, ?)",
+                    (revision["file_name"], revision["file_hash"])
+                )
+                conn.execute("DELETE FROM file_sheets WHERE file_name = ?", (revision["file_name"],))
+                conn.executemany(
+                    "INSERT INTO file_sheets (file_name, sheet, sheet_hash) VALUES (?, ?, ?)",
+                    ((revision["file_name"], sheet, sheet_hash) for sheet, sheet_hash in revision["sheet_hashes"].items())
+                )
+    finally:
+        conn.close()
+
+def clear_data() -> bool:
+    """Удаляет все записи (включая архив) и список обработанных файлов. Возвращает False, если данных не было"""
+    conn = connect()
+    try:
+        has_data = (conn.execute("SELECT 1 FROM entries LIMIT 1").fetchone() is not None or
+                    conn.execute("SELECT 1 FROM processed_files LIMIT 1").fetchone() is not None)
+        with conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM processed_files")
+            conn.execute("DELETE FROM file_sheets")
+            conn.execute("DELETE FROM meta WHERE key = 'archived_before'")
+            conn.execute("DELETE FROM archive_first_dates")
+            bump_data_version(conn)
+    finally:
+        conn.close()
+    for term in archived_terms():
+        os.remove(shard_path(term))
+        has_data = True
+    return has_data
+
+def save_subscription(chat_id: int, teacher: str):
+    """Подписывает чат на ежедневную рассылку расписания преподавателя (заменяет прежнюю подписку)"""
+    conn = connect()
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO subscriptions (chat_id, surname) VALUES (?, ?)", (chat_id, teacher))
+    finally:
+        conn.close()
+
+def delete_subscription(chat_id: int) -> bool:
+    """Отменяет подписку чата. Возвращает False, если подписки не было"""
+    conn = connect()
+    try:
+        with conn:
+            return conn.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,)).rowcount > 0
+    finally:
+        conn.close()
+
+def load_subscriptions() -> list:
+    """Все подписки: [(chat_id, ключ преподавателя)]"""
+    conn = connect()
+    try:
+        return conn.execute("SELECT chat_id, surname FROM subscriptions").fetchall()
+    finally:
+        conn.close()
+
+def shard_path(term: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f'{term}.db')
+
+def archived_terms() -> list:
+    """Семестры, для которых есть архивные шарды"""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    return sorted(name[:-3] for name in os.listdir(ARCHIVE_DIR) if name.endswith('.db'))
+
+def connect_shard(term: str):
+    """Открывает архивный шард семестра, создавая его при необходимости"""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    conn = sqlite3.connect(shard_path(term), timeout=30)
+    conn.executescript(ARCHIVE_SCHEMA)
+    upgrade_entry_key(conn)
+    return conn
+
+def insert_archived(rows) -> int:
+    """Добавляет строки (значения ENTRY_FIELDS и source_file) в шарды их семестров.
+    Возвращает число добавленных записей (уже имеющиеся пропускаются)"""
+    by_term = {}
+    for row in rows:
+        by_term.setdefault(term_of(date.fromisoformat(row[ENTRY_FIELDS.index('full_date')])), []).append(row)
+    inserted = 0
+    for term, term_rows in by_term.items():
+        shard = connect_shard(term)
+        try:
+            with shard:
+                before = shard.total_changes
+                shard.executemany(
+                    f"INSERT OR IGNORE INTO entries ({', '.join(ENTRY_FIELDS)}, source_file) "
+                    f"VALUES ({', '.join('?' * (len(ENTRY_FIELDS) + 1))})",
+                    term_rows
+                )
+                inserted += shard.total_changes - before
+        finally:
+            shard.close()
+    record_archive_first_dates(row for term_rows in by_term.values() for row in term_rows)
+    return inserted
+
+def record_archive_first_dates(rows):
+    """Учитывает строки, добавленные в шарды, в первых датах преподавателей в архиве"""
+    teacher_index, date_index = ENTRY_FIELDS.index('teacher'), ENTRY_FIELDS.index('full_date')
+    first_dates = {}
+    for row in rows:
+        teacher, full_date = row[teacher_index], row[date_index]
+        if teacher not in first_dates or full_date < first_dates[teacher]:
+            first_dates[teacher] = full_date
+    if not first_dates:
+        return
+    conn = connect()
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT INTO archive_first_dates (teacher, first_date) VALUES (?, ?) "
+                "ON CONFLICT (teacher) DO UPDATE SET first_date = MIN(first_date, excluded.first_date)",
+                first_dates.items()
+            )
+    finally:
+        conn.close()
+
+def rebuild_archive_first_dates(conn):
+    """Пересчитывает первые даты преподавателей по всем архивным шардам (полный просмотр шардов)"""
+    first_dates = {}
+    for term in archived_terms():
+        shard = sqlite3.connect(shard_path(term), timeout=30)
+        try:
+            for teacher, first_date in shard.execute("SELECT teacher, MIN(full_date) FROM entries GROUP BY teacher"):
+                if teacher not in first_dates or first_date < first_dates[teacher]:
+                    first_dates[teacher] = first_date
+        finally:
+            shard.close()
+    with conn:
+        conn.execute("DELETE FROM archive_first_dates")
+        conn.executemany("INSERT INTO archive_first_dates (teacher, first_date) VALUES (?, ?)", first_dates.items())
+
+def migrate_archive_first_dates(conn):
+    """Заполняет первые даты для шардов, созданных до появления таблицы archive_first_dates"""
+    if archived_terms() and conn.execute("SELECT 1 FROM archive_first_dates LIMIT 1").fetchone() is None:
+        rebuild_archive_first_dates(conn)
+
+def archive_new_entries(file_name: str, entries) -> int:
+    """Сохраняет новые записи файла с датами до границы архива сразу в архивные шарды"""
+    return insert_archived([entry_to_row(entry) + (file_name,) for entry in entries])
+
+def archive_entries(before: date) -> list:
+    """Переносит записи с датами раньше before из основной базы в архивные шарды по семестрам.
+    Возвращает перенесенные записи. Повторный запуск после сбоя безопасен: записи, уже попавшие
+    в шард, пропускаются, и перенос завершается"""
+    conn = connect()
+    try:
+        rows = conn.execute(
+            f"SELECT id, {', '.join(ENTRY_FIELDS)}, source_file FROM entries WHERE full_date < ?",
+            (before.isoformat(),)
+        ).fetchall()
+        insert_archived(row[1:] for row in rows)
+        archived_before = load_archived_before(conn)
+        with conn:
+            conn.executemany("DELETE FROM entries WHERE id = ?", ((row[0],) for row in rows))
+            if archived_before is None or before > archived_before:
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('archived_before', ?)", (before.isoformat(),))
+            if rows:
+                bump_data_version(conn)
+        return [row_to_entry(row[1:-1]) for row in rows]
+    finally:
+        conn.close()
+
+def load_archived_before(conn=None):
+    """Граница архива: записи с более ранними датами хранятся в архивных шардах (None - архива нет)"""
+    if conn is None:
+        conn = connect()
+        try:
+            return load_archived_before(conn)
+        finally:
+            conn.close()
+    row = conn.execute("SELECT value FROM meta WHERE key = 'archived_before'").fetchone()
+    return date.fromisoformat(row[0]) if row else None
+
+def load_archive_state() -> tuple:
+    """Граница архива и первые даты занятий в архиве по преподавателям: {строка преподавателя: дата}"""
+    conn = connect()
+    try:
+        first_dates = {
+            teacher: date.fromisoformat(first_date)
+            for teacher, first_date in conn.execute("SELECT teacher, first_date FROM archive_first_dates")
+        }
+        return load_archived_before(conn), first_dates
+    finally:
+        conn.close()
+
+def load_archived_entries(start_date: date, end_date: date, teacher_filter=None) -> list:
+    """Записи архива с датами в диапазоне [start_date, end_date], отсортированные по дате.
+    Открываются только шарды семестров, пересекающихся с диапазоном; teacher_filter - условие
+    на строку преподавателя"""
+    result = []
+    for term in archived_terms():
+        term_start, term_end = term_bounds(term)
+        if term_end < start_date or term_start > end_date:
+            continue
+        conn = sqlite3.connect(shard_path(term), timeout=30)
+        try:
+            query = f"SELECT {', '.join(ENTRY_FIELDS)} FROM entries WHERE full_date BETWEEN ? AND ?"
+            if teacher_filter is not None:
+                conn.create_function('teacher_matches', 1, teacher_filter, deterministic=True)
+                query += " AND teacher_matches(teacher)"
+            rows = conn.execute(query, (start_date.isoformat(), end_date.isoformat()))
+            result.extend(row_to_entry(row) for row in rows)
+        finally:
+            conn.close()
+    result.sort(key=lambda entry: entry['full_date'])
+    return result
+
+def clear_term(term: str) -> tuple:
+    """Удаляет записи одного семестра из основной базы и его архивный шард.
+    Возвращает (удаленные из основной базы записи, были ли данные)"""
+    start_date, end_date = term_bounds(term)
+    files = set()
+    archived = False
+    if os.path.exists(shard_path(term)):
+        shard = sqlite3.connect(shard_path(term), timeout=30)
+        try:
+            files.update(row[0] for row in shard.execute("SELECT DISTINCT source_file FROM entries"))
+            archived = shard.execute("SELECT 1 FROM entries LIMIT 1").fetchone() is not None
+        finally:
+            shard.close()
+        os.remove(shard_path(term))
+
+    conn = connect()
+    try:
+        rows = conn.execute(
+            f"SELECT {', '.join(ENTRY_FIELDS)}, source_file FROM entries WHERE full_date BETWEEN ? AND ?",
+            (start_date.isoformat(), end_date.isoformat())
+        ).fetchall()
+        files.update(row[-1] for row in rows)
+        files.discard(None)
+        with conn:
+            conn.execute("DELETE FROM entries WHERE full_date BETWEEN ? AND ?", (start_date.isoformat(), end_date.isoformat()))
+            # Файлы с записями семестра при повторной загрузке должны разбираться заново
+            conn.executemany("DELETE FROM processed_files WHERE name = ?", ((name,) for name in files))
+            conn.executemany("DELETE FROM file_sheets WHERE file_name = ?", ((name,) for name in files))
+            bump_data_version(conn)
+        if archived:
+            # Первые даты преподавателей могли приходиться на удаленный семестр
+            rebuild_archive_first_dates(conn)
+        return [row_to_entry(row[:-1]) for row in rows], bool(rows) or archived
+    finally:
+        conn.close()